@@ -2,6 +2,9 @@
 
 // Set to your deployed backend URL (no trailing slash)
 const API_BASE = 'https://lightspeed-extension-production.up.railway.app';
+const UNREACHABLE_ERROR = 'Could not reach export backend. Check that it is running and that API_BASE in the extension is correct.';
+// Exports run in the background on the server; poll the job this often until it finishes
+const EXPORT_POLL_MS = 3000;
 
 chrome.runtime.onInstalled.addListener(function (details) {
   if (details.reason === 'install') {
@@ -91,16 +94,40 @@ chrome.runtime.onMessage.addListener((msg, _sender, sendResponse) => {
     })
       .then(function (r) { return r.json(); })
       .then(function (data) {
-        if (data.success && data.airtable_url) {
-          chrome.tabs.create({ url: data.airtable_url });
-        } else if (data.error && (data.error.includes('Reconnect') || data.error.includes('Connection not found') || data.error.includes('Missing connection_id'))) {
-          chrome.tabs.create({ url: API_BASE + '/connect' });
+        if (data.job_id && data.status === 'running') {
+          pollExportJob(data.job_id, sendResponse);
+          return;
         }
-        sendResponse({ ok: data.success, error: data.error, output: data.output });
+        handleExportResult(data, sendResponse);
       })
       .catch(function () {
-        sendResponse({ ok: false, error: 'Could not reach export backend. Check that it is running and that API_BASE in the extension is correct.' });
+        sendResponse({ ok: false, error: UNREACHABLE_ERROR });
       });
   });
   return true;
 });
+
+/** Poll the backend until the queued export finishes, then report the result. */
+function pollExportJob(jobId, sendResponse) {
+  fetch(API_BASE + '/api/run/' + encodeURIComponent(jobId))
+    .then(function (r) { return r.json(); })
+    .then(function (data) {
+      if (data.status === 'running') {
+        setTimeout(function () { pollExportJob(jobId, sendResponse); }, EXPORT_POLL_MS);
+        return;
+      }
+      handleExportResult(data, sendResponse);
+    })
+    .catch(function () {
+      sendResponse({ ok: false, error: UNREACHABLE_ERROR });
+    });
+}
+
+function handleExportResult(data, sendResponse) {
+  if (data.success && data.airtable_url) {
+    chrome.tabs.create({ url: data.airtable_url });
+  } else if (data.error && (data.error.includes('Reconnect') || data.error.includes('Connection not found') || data.error.includes('Missing connection_id'))) {
+    chrome.tabs.create({ url: API_BASE + '/connect' });
+  }
+  sendResponse({ ok: data.success, error: data.error, output: data.output });
+}
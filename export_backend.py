@@ -9,87 +9,394 @@ Run: python export_backend.py
 from __future__ import annotations
 
 import base64
+import csv
+import functools
 import hmac
 import hashlib
+import io
 import json
 import os
 import re
 import secrets
 import sqlite3
-import subprocess
 import sys
-import uuid
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from urllib.parse import parse_qs, quote, urlparse
+from urllib.parse import quote, unquote_plus
 
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
 
 try:
-    from flask import Flask, jsonify, redirect, render_template_string, request, session, url_for
+    from flask import (
+        Flask,
+        Response,
+        jsonify,
+        redirect,
+        request,
+        session,
+        stream_with_context,
+        url_for,
+    )
+    from jinja2 import DictLoader, FileSystemBytecodeCache
+    from markupsafe import escape
     from werkzeug.security import check_password_hash, generate_password_hash
 except ImportError:
     print("Install Flask: pip install flask", file=sys.stderr)
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used without it
+    orjson = None
+
 import lightspeed_export as ls
 
+_VALID_FIELD_IDS = frozenset(f["id"].lower() for f in ls.AVAILABLE_FIELDS)
+
+
+def _json_dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj)
+
+
+def _json_loads(raw):
+    """Parse JSON; orjson's decode error subclasses json.JSONDecodeError, so callers catch either."""
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
 app = Flask(__name__)
-app.secret_key = os.environ.get("FLASK_SECRET_KEY", secrets.token_hex(32))
+
+if orjson is not None:
+    try:
+        from flask.json.provider import DefaultJSONProvider
+    except ImportError:  # Flask < 2.2 has no pluggable JSON provider
+        DefaultJSONProvider = None
+
+    if DefaultJSONProvider is not None:
+
+        class _OrjsonProvider(DefaultJSONProvider):
+            """jsonify and the Jinja tojson filter serialize with orjson (tojson still HTML-escapes the result)."""
+
+            def dumps(self, obj, **kwargs) -> str:
+                option = orjson.OPT_NON_STR_KEYS
+                if kwargs.get("sort_keys", self.sort_keys):
+                    option |= orjson.OPT_SORT_KEYS
+                if kwargs.get("indent"):
+                    option |= orjson.OPT_INDENT_2
+                try:
+                    return orjson.dumps(obj, default=kwargs.get("default", self.default), option=option).decode()
+                except TypeError:
+                    return super().dumps(obj, **kwargs)
+
+            def loads(self, s, **kwargs):
+                return orjson.loads(s)
+
+        # Must be set before app.jinja_env is first built so tojson picks it up
+        app.json = _OrjsonProvider(app)
+
 SCRIPT_DIR = Path(__file__).resolve().parent
 # Use CONNECTIONS_DB to point at a persistent path (e.g. Railway volume /data/connections.db)
 # so connection keys and shared API keys survive deploys/restarts.
 DB_PATH = Path(os.environ.get("CONNECTIONS_DB", str(SCRIPT_DIR / "connections.db")))
 
 
+def _persistent_secret(path: Path) -> str:
+    """Read the generated secret at path, creating it (mode 0600) on first boot. Without FLASK_SECRET_KEY
+    this keeps session cookies and gallery share links valid across restarts."""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        try:
+            existing = path.read_text().strip()
+        except OSError:
+            existing = ""
+        if existing:
+            return existing
+        return secrets.token_hex(32)
+    except OSError:
+        return secrets.token_hex(32)  # read-only filesystem: per-process secret, as before
+    secret = secrets.token_hex(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(secret)
+    return secret
+
+
+# Kept next to the DB so it lives on the same (persistent) volume
+app.secret_key = os.environ.get("FLASK_SECRET_KEY") or _persistent_secret(DB_PATH.with_name(".flask_secret"))
+# Server-wide credentials, read once (env doesn't change after startup)
+_LS_CLIENT_ID = ls.env("LIGHTSPEED_CLIENT_ID")
+_LS_CLIENT_SECRET = ls.env("LIGHTSPEED_CLIENT_SECRET")
+_SERVER_AIRTABLE_KEY = (os.environ.get("AIRTABLE_API_KEY") or "").strip() or None
+# Lightspeed authorize URL with the client id pre-quoted; only state and redirect_uri vary per request
+# (quote(..., safe="") leaves no braces in the client id, so format_map only sees the two fields)
+_AUTH_URL_TEMPLATE = (
+    f"{ls.AUTHORIZE_URL}?response_type=code&client_id={quote(_LS_CLIENT_ID or '', safe='')}"
+    "&scope=employee:all&state={state}&redirect_uri={redirect_uri}"
+)
+
+
+_db_local = threading.local()
+
+# Hot-path SQL, kept as constants so every call hits the connection's prepared-statement cache.
+# Columns are listed explicitly (no SELECT *) so rows look the same whatever columns migrations add.
+_CONNECTION_COLUMNS = (
+    "id", "access_token", "refresh_token", "account_id", "airtable_api_key",
+    "airtable_base_id", "airtable_table_name", "created_at", "selected_fields", "expires_at",
+)
+_SQL_GET_CONN = f"SELECT {', '.join(_CONNECTION_COLUMNS)} FROM connections WHERE id = ?"
+_SQL_GET_SELECTED_FIELDS = "SELECT selected_fields FROM connections WHERE id = ?"
+_SQL_UPDATE_TOKENS = (
+    "UPDATE connections SET access_token = ?, refresh_token = ?, expires_at = ? WHERE id = ?"
+)
+_SQL_LOAD_BUNDLE = f"""SELECT {', '.join('c.' + col for col in _CONNECTION_COLUMNS)}, sk.api_key AS shared_api_key
+    FROM connections c
+    LEFT JOIN connection_shared_keys l ON l.connection_id = c.id
+    LEFT JOIN shared_keys sk ON sk.id = l.shared_key_id
+    WHERE c.id = ?"""
+
+
 def _get_db() -> sqlite3.Connection:
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+    """Return this thread's SQLite connection, opened once (WAL, autocommit) and reused across requests."""
+    conn = getattr(_db_local, "conn", None)
+    if conn is None:
+        # timeout is SQLite's busy_timeout: a BEGIN IMMEDIATE waits for another thread's write
+        conn = sqlite3.connect(
+            DB_PATH, timeout=30, check_same_thread=False, isolation_level=None, cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA cache_size=-20000")
+        conn.execute("PRAGMA mmap_size=134217728")
+        _db_local.conn = conn
     return conn
 
 
 def _init_db() -> None:
-    with _get_db() as conn:
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS connections (
-                id TEXT PRIMARY KEY,
-                access_token TEXT NOT NULL,
-                refresh_token TEXT NOT NULL,
-                account_id TEXT NOT NULL,
-                airtable_api_key TEXT NOT NULL,
-                airtable_base_id TEXT NOT NULL,
-                airtable_table_name TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
-        """)
-        conn.commit()
-        # Migration: add selected_fields if missing (SQLite has no IF NOT EXISTS for columns)
+    conn = _get_db()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS connections (
+            id TEXT PRIMARY KEY,
+            access_token TEXT NOT NULL,
+            refresh_token TEXT NOT NULL,
+            account_id TEXT NOT NULL,
+            airtable_api_key TEXT NOT NULL,
+            airtable_base_id TEXT NOT NULL,
+            airtable_table_name TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        # Migration: add selected_fields and expires_at (access token expiry, so unexpired tokens aren't
+        # refreshed on every request). Databases from before user_version was tracked may already have
+        # either column, and SQLite has no IF NOT EXISTS for columns.
+        for column in ("selected_fields", "expires_at"):
+            try:
+                conn.execute(f"ALTER TABLE connections ADD COLUMN {column} TEXT")
+            except sqlite3.OperationalError:
+                pass  # column already exists
+        conn.execute("PRAGMA user_version = 1")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS shared_keys (
+            id TEXT PRIMARY KEY,
+            label TEXT NOT NULL,
+            password_hash TEXT NOT NULL,
+            api_key TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS connection_shared_keys (
+            connection_id TEXT PRIMARY KEY,
+            shared_key_id TEXT NOT NULL
+        )
+    """)
+    # Covering index: the connection -> shared key join is answered from the index alone
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_csk_conn_sk ON connection_shared_keys(connection_id, shared_key_id)"
+    )
+    # Export job outcomes, so a poll after a restart (or from another worker) still gets an answer
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS export_jobs (
+            id TEXT PRIMARY KEY,
+            connection_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            result TEXT,
+            created_at TEXT NOT NULL
+        )
+    """)
+
+
+@contextmanager
+def _tx():
+    """Group several helper writes into one BEGIN IMMEDIATE ... COMMIT (rolled back on error).
+
+    Nested use joins the outer transaction.
+    """
+    conn = _get_db()
+    if conn.in_transaction:
+        yield conn
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    pending: list = []
+    _db_local.after_commit = pending
+    try:
         try:
-            conn.execute("ALTER TABLE connections ADD COLUMN selected_fields TEXT")
-            conn.commit()
-        except sqlite3.OperationalError:
-            pass  # column already exists
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS shared_keys (
-                id TEXT PRIMARY KEY,
-                label TEXT NOT NULL,
-                password_hash TEXT NOT NULL,
-                api_key TEXT NOT NULL,
-                created_at TEXT NOT NULL
-            )
-        """)
-        conn.execute("""
-            CREATE TABLE IF NOT EXISTS connection_shared_keys (
-                connection_id TEXT PRIMARY KEY,
-                shared_key_id TEXT NOT NULL
-            )
-        """)
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
         conn.commit()
+    finally:
+        _db_local.after_commit = None
+        # Also after a rollback: a read inside the transaction may have cached rows that never committed
+        for fn in pending:
+            fn()
+
+
+def _after_commit(fn) -> None:
+    """Run fn once the current _tx() ends, or right away outside one. Cache invalidations go through
+    this: dropped before COMMIT, another thread could re-cache the old row for the whole TTL."""
+    pending = getattr(_db_local, "after_commit", None)
+    if pending is None:
+        fn()
+    else:
+        pending.append(fn)
+
+
+class _TTLCache:
+    """Small thread-safe dict cache with per-entry expiry and a size cap (oldest entry evicted first)."""
+
+    def __init__(self, ttl: float, maxsize: int = 1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data: dict = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            hit = self._data.get(key)
+            if hit is None:
+                return default
+            if hit[0] <= time.monotonic():
+                del self._data[key]
+                return default
+            return hit[1]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+            if len(self._data) >= self.maxsize:
+                self._data.pop(next(iter(self._data)))
+            self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def add(self, key, value) -> bool:
+        """Insert without evicting a live entry: when full (after dropping expired ones), return False."""
+        with self._lock:
+            if len(self._data) >= self.maxsize:
+                now = time.monotonic()
+                for k in [k for k, (expires, _) in self._data.items() if expires <= now]:
+                    del self._data[k]
+                if len(self._data) >= self.maxsize:
+                    return False
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            return True
+
+    def pop(self, key) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> list:
+        """Keys of entries that haven't expired yet."""
+        now = time.monotonic()
+        with self._lock:
+            return [k for k, (expires, _) in self._data.items() if expires > now]
+
+
+# Connection rows only change through the _update_* helpers below, which invalidate these.
+# The TTL bounds staleness when several worker processes share one DB file.
+CONNECTION_CACHE_TTL_SEC = 60
+_conn_cache = _TTLCache(CONNECTION_CACHE_TTL_SEC)
+_bundle_cache = _TTLCache(CONNECTION_CACHE_TTL_SEC)
+
+
+def _invalidate_connection(conn_id: str) -> None:
+    def drop() -> None:
+        _conn_cache.pop(conn_id)
+        _bundle_cache.pop(conn_id)
+
+    _after_commit(drop)
+
+
+@app.teardown_appcontext
+def _db_teardown(exc):
+    """Connections outlive the request; only roll back a transaction left open by a failed request."""
+    conn = getattr(_db_local, "conn", None)
+    if exc is not None and conn is not None and conn.in_transaction:
+        conn.rollback()
+
+
+def _utc_timestamp(dt: datetime | None = None) -> str:
+    """ISO-8601 UTC timestamp to the second, as stored in the DB."""
+    return (dt or datetime.now(timezone.utc)).isoformat(timespec="seconds")
+
+
+# Refresh this long before Lightspeed says the access token expires
+TOKEN_EXPIRY_MARGIN_SEC = 60
+
+
+def _token_expires_at(expires_in) -> str | None:
+    """Turn an OAuth expires_in (seconds) into a stored UTC timestamp, or None if unknown."""
+    try:
+        seconds = int(expires_in) - TOKEN_EXPIRY_MARGIN_SEC
+    except (TypeError, ValueError):
+        return None
+    return _utc_timestamp(datetime.now(timezone.utc) + timedelta(seconds=seconds))
+
+
+def _token_expiry(row: sqlite3.Row) -> datetime | None:
+    """The stored access token's expires_at (already TOKEN_EXPIRY_MARGIN_SEC early), or None if unknown."""
+    try:
+        raw = row["expires_at"]
+    except (KeyError, IndexError):
+        return None
+    if not raw:
+        return None
+    try:
+        expires_at = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    return expires_at
+
+
+def _token_still_valid(row: sqlite3.Row, min_valid_sec: float = 0) -> bool:
+    """True if the stored access token is good for at least min_valid_sec more seconds."""
+    expires_at = _token_expiry(row)
+    return expires_at is not None and expires_at > datetime.now(timezone.utc) + timedelta(seconds=min_valid_sec)
 
 
 DEFAULT_FIELD_IDS = ["name", "cost", "price", "vendor_name", "image"]
+_DEFAULT_FIELDS_JSON = _json_dumps(DEFAULT_FIELD_IDS)
 
 
 def _create_connection(
@@ -100,88 +407,110 @@ def _create_connection(
     airtable_api_key: str,
     airtable_base_id: str,
     airtable_table_name: str,
+    expires_in: int | None = None,
 ) -> str:
-    conn_id = str(uuid.uuid4())
-    from datetime import datetime
-    default_fields_json = json.dumps(DEFAULT_FIELD_IDS)
-    with _get_db() as db:
-        db.execute(
-            """INSERT INTO connections
-               (id, access_token, refresh_token, account_id, airtable_api_key, airtable_base_id, airtable_table_name, created_at, selected_fields)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                conn_id,
-                access_token,
-                refresh_token,
-                account_id,
-                airtable_api_key,
-                airtable_base_id,
-                airtable_table_name,
-                datetime.utcnow().isoformat() + "Z",
-                default_fields_json,
-            ),
-        )
-        db.commit()
+    conn_id = secrets.token_urlsafe(16)
+    _get_db().execute(
+        """INSERT INTO connections
+           (id, access_token, refresh_token, account_id, airtable_api_key, airtable_base_id, airtable_table_name, created_at, selected_fields, expires_at)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        (
+            conn_id,
+            access_token,
+            refresh_token,
+            account_id,
+            airtable_api_key,
+            airtable_base_id,
+            airtable_table_name,
+            _utc_timestamp(),
+            _DEFAULT_FIELDS_JSON,
+            _token_expires_at(expires_in),
+        ),
+    )
     return conn_id
 
 
 def _get_connection(conn_id: str) -> sqlite3.Row | None:
-    with _get_db() as db:
-        row = db.execute("SELECT * FROM connections WHERE id = ?", (conn_id,)).fetchone()
-        return row
-
-
-def _update_connection_tokens(conn_id: str, access_token: str, refresh_token: str) -> None:
-    with _get_db() as db:
-        db.execute(
-            "UPDATE connections SET access_token = ?, refresh_token = ? WHERE id = ?",
-            (access_token, refresh_token, conn_id),
-        )
-        db.commit()
+    row = _conn_cache.get(conn_id)
+    if row is None:
+        row = _get_db().execute(_SQL_GET_CONN, (conn_id,)).fetchone()
+        if row is not None:
+            _conn_cache.set(conn_id, row)
+    return row
+
+
+def _update_connection_tokens(
+    conn_id: str, access_token: str, refresh_token: str, expires_in: int | None = None
+) -> None:
+    _get_db().execute(
+        _SQL_UPDATE_TOKENS, (access_token, refresh_token, _token_expires_at(expires_in), conn_id)
+    )
+    _invalidate_connection(conn_id)
 
 
 def _get_selected_fields(conn_id: str) -> list[str]:
     """Return selected field ids for connection; defaults to DEFAULT_FIELD_IDS if not set."""
-    row = _get_connection(conn_id)
+    # Use the cached full row if there is one, otherwise read just the one column
+    row = _conn_cache.get(conn_id) or _get_db().execute(_SQL_GET_SELECTED_FIELDS, (conn_id,)).fetchone()
     if not row:
         return DEFAULT_FIELD_IDS
-    raw = ""
+    return _selected_fields_from_row(row)
+
+
+def _selected_fields_raw(row: sqlite3.Row) -> str:
     try:
-        raw = (row["selected_fields"] or "").strip()
+        return (row["selected_fields"] or "").strip()
     except (KeyError, IndexError, TypeError):
-        pass
+        return ""
+
+
+def _selected_fields_from_row(row: sqlite3.Row) -> list[str]:
+    """Parse selected_fields from an already-loaded connections row."""
+    return list(_parse_selected_fields(_selected_fields_raw(row)))
+
+
+# Parsed per distinct stored value: a handful of selections are shared by every connection, so the
+# hot paths (/api/run, gallery) skip json parsing and validation after the first time.
+@functools.lru_cache(maxsize=512)
+def _parse_selected_fields(raw: str) -> tuple[str, ...]:
     if not raw:
-        return DEFAULT_FIELD_IDS
+        return tuple(DEFAULT_FIELD_IDS)
     try:
-        ids = json.loads(raw)
+        ids = _json_loads(raw)
         if isinstance(ids, list) and ids:
-            valid = {f["id"] for f in ls.AVAILABLE_FIELDS}
-            return [x for x in ids if str(x).lower() in valid] or DEFAULT_FIELD_IDS
+            return tuple(x for x in ids if str(x).lower() in _VALID_FIELD_IDS) or tuple(DEFAULT_FIELD_IDS)
     except (json.JSONDecodeError, TypeError):
         pass
-    return DEFAULT_FIELD_IDS
+    return tuple(DEFAULT_FIELD_IDS)
+
+
+def _selected_field_set(row: sqlite3.Row) -> frozenset[str]:
+    """Selected field ids for membership tests (the settings checkboxes). Order lives in the list form."""
+    return _selected_field_set_for(_selected_fields_raw(row))
+
+
+@functools.lru_cache(maxsize=256)
+def _selected_field_set_for(raw: str) -> frozenset[str]:
+    return frozenset(_parse_selected_fields(raw))
 
 
 def _update_connection_fields(conn_id: str, field_ids: list[str]) -> None:
-    valid = {f["id"] for f in ls.AVAILABLE_FIELDS}
-    filtered = [x for x in field_ids if str(x).lower() in valid]
+    filtered = [x for x in field_ids if str(x).lower() in _VALID_FIELD_IDS]
     if not filtered:
         filtered = DEFAULT_FIELD_IDS
-    with _get_db() as db:
-        db.execute(
-            "UPDATE connections SET selected_fields = ? WHERE id = ?",
-            (json.dumps(filtered), conn_id),
-        )
-        db.commit()
+    _get_db().execute(
+        "UPDATE connections SET selected_fields = ? WHERE id = ?",
+        (_json_dumps(filtered), conn_id),
+    )
+    _invalidate_connection(conn_id)
 
 
 def _update_connection_airtable_key(conn_id: str, api_key: str) -> None:
-    with _get_db() as db:
-        db.execute(
-            "UPDATE connections SET airtable_api_key = ? WHERE id = ?",
-            (api_key.strip(), conn_id),
-        )
-        db.commit()
+    _get_db().execute(
+        "UPDATE connections SET airtable_api_key = ? WHERE id = ?",
+        (api_key.strip(), conn_id),
+    )
+    _invalidate_connection(conn_id)
 
 
 def _update_connection_base(conn_id: str, airtable_base_url_or_id: str) -> bool:
@@ -189,101 +518,195 @@ def _update_connection_base(conn_id: str, airtable_base_url_or_id: str) -> bool:
     base_id = _extract_airtable_base_id(airtable_base_url_or_id)
     if not base_id:
         return False
-    with _get_db() as db:
-        db.execute(
-            "UPDATE connections SET airtable_base_id = ? WHERE id = ?",
-            (base_id, conn_id),
-        )
-        db.commit()
+    _get_db().execute(
+        "UPDATE connections SET airtable_base_id = ? WHERE id = ?",
+        (base_id, conn_id),
+    )
+    _invalidate_connection(conn_id)
     return True
 
 
+def _load_connection_bundle(conn_id: str) -> sqlite3.Row | None:
+    """Load the connection row plus its unlocked shared key (as shared_api_key) in one query."""
+    row = _bundle_cache.get(conn_id)
+    if row is None:
+        row = _get_db().execute(_SQL_LOAD_BUNDLE, (conn_id,)).fetchone()
+        if row is not None:
+            _bundle_cache.set(conn_id, row)
+    return row
+
+
+def _airtable_key_from_bundle(row: sqlite3.Row) -> str | None:
+    """_get_airtable_key_for_connection for an already-loaded bundle row."""
+    return (
+        (row["shared_api_key"] or "").strip()
+        or (row["airtable_api_key"] or "").strip()
+        or _SERVER_AIRTABLE_KEY
+    )
+
+
 def _get_airtable_key_for_connection(conn_id: str) -> str | None:
     """Resolve Airtable API key: shared key (if unlocked) > connection's key > server env."""
-    row = _get_connection(conn_id)
+    row = _load_connection_bundle(conn_id)
     if not row:
         return None
-    with _get_db() as db:
-        link = db.execute(
-            "SELECT shared_key_id FROM connection_shared_keys WHERE connection_id = ?",
-            (conn_id,),
-        ).fetchone()
-        if link:
-            sk = db.execute(
-                "SELECT api_key FROM shared_keys WHERE id = ?",
-                (link[0],),
-            ).fetchone()
-            if sk and (sk[0] or "").strip():
-                return sk[0].strip()
-    return (row["airtable_api_key"] or "").strip() or os.environ.get("AIRTABLE_API_KEY", "").strip() or None
+    return _airtable_key_from_bundle(row)
+
+
+# The store-key list is re-rendered on every connect page and error path but only changes when a
+# key is created, which clears it. Holds the list, its /api/shared-keys JSON body and the rendered
+# /connect page.
+SHARED_KEYS_CACHE_TTL_SEC = 30
+_shared_keys_cache = _TTLCache(SHARED_KEYS_CACHE_TTL_SEC, maxsize=4)
 
 
 def _list_shared_keys() -> list[dict]:
-    with _get_db() as db:
-        rows = db.execute(
+    """Callers must not mutate the returned list (it is cached)."""
+    keys = _shared_keys_cache.get("list")
+    if keys is None:
+        rows = _get_db().execute(
             "SELECT id, label, created_at FROM shared_keys ORDER BY created_at DESC"
         ).fetchall()
-        return [{"id": r[0], "label": r[1], "created_at": r[2]} for r in rows]
+        keys = [{"id": r[0], "label": r[1], "created_at": r[2]} for r in rows]
+        _shared_keys_cache.set("list", keys)
+    return keys
+
+
+def _shared_keys_json() -> str:
+    body = _shared_keys_cache.get("json")
+    if body is None:
+        body = _json_dumps({"shared_keys": _list_shared_keys()})
+        _shared_keys_cache.set("json", body)
+    return body
 
 
 def _create_shared_key(label: str, password: str, api_key: str) -> str:
-    sk_id = str(uuid.uuid4())
-    from datetime import datetime
-    pwh = generate_password_hash(password, method="scrypt")
-    with _get_db() as db:
-        db.execute(
-            """INSERT INTO shared_keys (id, label, password_hash, api_key, created_at)
-               VALUES (?, ?, ?, ?, ?)""",
-            (sk_id, label.strip(), pwh, api_key.strip(), datetime.utcnow().isoformat() + "Z"),
-        )
-        db.commit()
+    return _insert_shared_key(label, generate_password_hash(password, method="scrypt"), api_key)
+
+
+def _insert_shared_key(label: str, pwh: str, api_key: str) -> str:
+    """_create_shared_key with the password already hashed, so the scrypt run can stay outside _tx()."""
+    sk_id = secrets.token_urlsafe(16)
+    _get_db().execute(
+        """INSERT INTO shared_keys (id, label, password_hash, api_key, created_at)
+           VALUES (?, ?, ?, ?, ?)""",
+        (sk_id, label.strip(), pwh, api_key.strip(), _utc_timestamp()),
+    )
+    _after_commit(_shared_keys_cache.clear)
     return sk_id
 
 
+# Successful scrypt checks are remembered briefly so repeated unlocks/verifies skip the KDF.
+# The stored hash is part of the key, so a changed password never matches a stale entry.
+PASSWORD_CHECK_CACHE_TTL_SEC = 300
+_password_check_cache = _TTLCache(PASSWORD_CHECK_CACHE_TTL_SEC)
+
+
+def _check_shared_key_password(password_hash: str, password: str) -> bool:
+    cache_key = (password_hash, hashlib.sha256(password.encode("utf-8")).hexdigest())
+    if _password_check_cache.get(cache_key):
+        return True
+    if not check_password_hash(password_hash, password):
+        return False
+    _password_check_cache.set(cache_key, True)
+    return True
+
+
 def _verify_shared_key_password(shared_key_id: str, password: str) -> bool:
     """Verify password for a shared key without linking. Returns True if correct."""
-    with _get_db() as db:
-        row = db.execute(
-            "SELECT password_hash FROM shared_keys WHERE id = ?",
-            (shared_key_id,),
-        ).fetchone()
-        return bool(row and check_password_hash(row[0], password))
+    row = _get_db().execute(
+        "SELECT password_hash FROM shared_keys WHERE id = ?",
+        (shared_key_id,),
+    ).fetchone()
+    return bool(row and _check_shared_key_password(row[0], password))
 
 
 def _unlock_shared_key(shared_key_id: str, password: str, connection_id: str) -> bool:
-    with _get_db() as db:
-        row = db.execute(
-            "SELECT id, password_hash FROM shared_keys WHERE id = ?",
-            (shared_key_id,),
-        ).fetchone()
-        if not row or not check_password_hash(row[1], password):
-            return False
-        db.execute(
-            """INSERT OR REPLACE INTO connection_shared_keys (connection_id, shared_key_id)
-               VALUES (?, ?)""",
-            (connection_id, shared_key_id),
-        )
-        db.commit()
+    if not _verify_shared_key_password(shared_key_id, password):
+        return False
+    _link_shared_key(shared_key_id, connection_id)
     return True
 
 
-def _ensure_fresh_tokens(conn_id: str) -> tuple[str, str]:
-    """Load connection, refresh if needed, update DB, return (access_token, refresh_token)."""
-    row = _get_connection(conn_id)
+def _link_shared_key(shared_key_id: str, connection_id: str) -> None:
+    """Link an already-verified shared key to a connection."""
+    _get_db().execute(
+        """INSERT OR REPLACE INTO connection_shared_keys (connection_id, shared_key_id)
+           VALUES (?, ?)""",
+        (connection_id, shared_key_id),
+    )
+    _invalidate_connection(connection_id)
+
+
+def _ensure_fresh_tokens(row: sqlite3.Row | None) -> tuple[str, str]:
+    """Return the loaded connection's (access_token, refresh_token), refreshing first if expired."""
     if not row:
         raise ValueError("Connection not found")
-    client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-    client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
+    _active_connections.set(row["id"], True)
+    return _refresh_tokens_if_needed(row)
+
+
+_refresh_inflight: dict[str, Future] = {}
+_refresh_inflight_lock = threading.Lock()
+
+
+def _stored_token_usable(row: sqlite3.Row, min_valid_sec: float, stale_access_token: str | None) -> bool:
+    return row["access_token"] != stale_access_token and _token_still_valid(row, min_valid_sec)
+
+
+def _refresh_tokens_if_needed(
+    row: sqlite3.Row, min_valid_sec: float = 0, stale_access_token: str | None = None
+) -> tuple[str, str]:
+    """Refresh unless the access token is good for min_valid_sec more seconds; update DB, return tokens.
+    A stored access token equal to stale_access_token (one Lightspeed rejected) is refreshed regardless."""
+    conn_id = row["id"]
+    client_id = _LS_CLIENT_ID
+    client_secret = _LS_CLIENT_SECRET
     if not client_id or not client_secret:
         raise ValueError("Server missing LIGHTSPEED_CLIENT_ID / LIGHTSPEED_CLIENT_SECRET")
+    if _stored_token_usable(row, min_valid_sec, stale_access_token):
+        return row["access_token"], row["refresh_token"]
+    # One refresh per connection at a time: concurrent callers wait for it and share the new tokens
+    with _refresh_inflight_lock:
+        pending = _refresh_inflight.get(conn_id)
+        if pending is None:
+            future: Future = Future()
+            _refresh_inflight[conn_id] = future
+    if pending is not None:
+        return pending.result()
+    try:
+        tokens = _refresh_tokens(conn_id, row, min_valid_sec, client_id, client_secret, stale_access_token)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(tokens)
+    finally:
+        with _refresh_inflight_lock:
+            _refresh_inflight.pop(conn_id, None)
+    return tokens
+
+
+def _refresh_tokens(
+    conn_id: str,
+    row: sqlite3.Row,
+    min_valid_sec: float,
+    client_id: str,
+    client_secret: str,
+    stale_access_token: str | None = None,
+) -> tuple[str, str]:
+    # Re-read: a refresh that finished just before we took the lead has already rotated the refresh token
+    row = _get_connection(conn_id) or row
     access_token = row["access_token"]
     refresh_token = row["refresh_token"]
+    if _stored_token_usable(row, min_valid_sec, stale_access_token):
+        return access_token, refresh_token
     try:
         data = ls.refresh_oauth_token(refresh_token, client_id, client_secret)
         access_token = data["access_token"]
         if data.get("refresh_token"):
             refresh_token = data["refresh_token"]
-        _update_connection_tokens(conn_id, access_token, refresh_token)
+        _update_connection_tokens(conn_id, access_token, refresh_token, data.get("expires_in"))
     except Exception as e:
         raise ValueError(
             "Lightspeed sign-in has expired or was revoked. Please reconnect: "
@@ -292,6 +715,78 @@ def _ensure_fresh_tokens(conn_id: str) -> tuple[str, str]:
     return access_token, refresh_token
 
 
+def _session_refresher(conn_id: str):
+    """Refresh hook for a connection's SessionWithRefresh (gallery sessions and export jobs). Refreshes go
+    through the per-connection single flight and the DB, so a long-lived session picks up tokens the
+    background refresher or another request already rotated instead of spending a revoked refresh
+    token, and the tokens it does rotate are stored."""
+
+    def refresh(stale_access_token: str) -> tuple[str, str, float | None]:
+        row = _get_connection(conn_id)
+        if not row:
+            raise ls.LightspeedAuthError("Connection not found")
+        try:
+            _refresh_tokens_if_needed(row, 0, stale_access_token)
+        except ValueError as e:
+            raise ls.LightspeedAuthError(str(e)) from None
+        return _stored_tokens(conn_id)
+
+    return refresh
+
+
+def _stored_tokens(conn_id: str) -> tuple[str, str, float | None]:
+    """The connection's current (access_token, refresh_token, expires_in) from the DB, which every
+    refresh goes through, so these are always the newest tokens."""
+    row = _get_connection(conn_id)
+    if not row:
+        raise ls.LightspeedAuthError("Connection not found")
+    expires_at = _token_expiry(row)
+    expires_in = None
+    if expires_at is not None:
+        expires_in = (expires_at - datetime.now(timezone.utc)).total_seconds() + TOKEN_EXPIRY_MARGIN_SEC
+    return row["access_token"], row["refresh_token"], expires_in
+
+
+# Background refresh: connections used in the last hour get a new access token shortly before
+# the current one expires, so requests rarely have to wait on Lightspeed's token endpoint.
+TOKEN_REFRESH_INTERVAL_SEC = 60
+TOKEN_REFRESH_LEAD_SEC = 300
+_active_connections = _TTLCache(3600, maxsize=4096)
+_token_refresher_started = False
+_token_refresher_lock = threading.Lock()
+
+
+def _refresh_active_tokens() -> None:
+    for conn_id in _active_connections.keys():
+        row = _get_connection(conn_id)
+        if not row or _token_still_valid(row, TOKEN_REFRESH_LEAD_SEC):
+            continue
+        try:
+            _refresh_tokens_if_needed(row, TOKEN_REFRESH_LEAD_SEC)
+        except ValueError as e:
+            print(f"Background token refresh failed for {conn_id}: {e}", file=sys.stderr)
+            _active_connections.pop(conn_id)
+
+
+def _token_refresh_loop() -> None:
+    while True:
+        time.sleep(TOKEN_REFRESH_INTERVAL_SEC)
+        try:
+            _refresh_active_tokens()
+        except Exception as e:
+            print(f"Background token refresh error: {e}", file=sys.stderr)
+
+
+def _start_token_refresher() -> None:
+    """Start the background token refresh thread once per process."""
+    global _token_refresher_started
+    with _token_refresher_lock:
+        if _token_refresher_started:
+            return
+        threading.Thread(target=_token_refresh_loop, name="token-refresh", daemon=True).start()
+        _token_refresher_started = True
+
+
 @app.after_request
 def _cors(resp):
     if request.path.startswith("/api/"):
@@ -309,6 +804,181 @@ def _cors_preflight():
 
 # ----- API (for extension) -----
 
+EXPORT_TIMEOUT_SEC = 3600
+# Only the tail of an export's log is returned to the extension
+EXPORT_OUTPUT_MAX_LINES = 2000
+# Exports run in the background so /api/run returns a job id immediately; the extension polls /api/run/<job_id>.
+_export_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="export")
+_export_jobs: dict[str, tuple[float, Future]] = {}
+_export_jobs_lock = threading.Lock()
+
+
+# The export job whose log the current context writes to; lightspeed_export's worker pools copy the
+# submitting context, so prints from their threads land in the same job's log
+_job_log: ContextVar[deque | None] = ContextVar("_job_log", default=None)
+
+
+class _JobStderr(io.TextIOBase):
+    """sys.stderr stand-in while export jobs run: prints (the export module logs with
+    print(..., file=sys.stderr)) from a job's context go to that job's log; everything else reaches the
+    real stream."""
+
+    def __init__(self, stream) -> None:
+        self._stream = stream
+
+    def write(self, s: str) -> int:
+        sink = _job_log.get()
+        if sink is None:
+            return self._stream.write(s)
+        sink.append(s)
+        return len(s)
+
+    def flush(self) -> None:
+        self._stream.flush()
+
+    def writable(self) -> bool:
+        return True
+
+
+_job_stderr: _JobStderr | None = None
+_job_stderr_users = 0
+_job_stderr_lock = threading.Lock()
+
+
+@contextmanager
+def _capture_job_output(log: deque):
+    """Send this context's stderr writes to log. sys.stderr is swapped only while at least one job
+    runs, and only one stand-in is installed however many jobs overlap."""
+    global _job_stderr, _job_stderr_users
+    with _job_stderr_lock:
+        if _job_stderr_users == 0:
+            _job_stderr = _JobStderr(sys.stderr)
+            sys.stderr = _job_stderr
+        _job_stderr_users += 1
+    token = _job_log.set(log)
+    try:
+        yield
+    finally:
+        _job_log.reset(token)
+        with _job_stderr_lock:
+            _job_stderr_users -= 1
+            if _job_stderr_users == 0:
+                # Leave sys.stderr alone if something else replaced it in the meantime
+                if sys.stderr is _job_stderr:
+                    sys.stderr = _job_stderr._stream
+                _job_stderr = None
+
+
+def _run_export_job(row: sqlite3.Row, category_id: str, listing_filters: dict) -> dict:
+    """Refresh tokens and run the export for one connection, in process. Runs on the export executor."""
+    try:
+        access_token, refresh_token = _ensure_fresh_tokens(row)
+    except ValueError as e:
+        return {"success": False, "error": str(e)}
+    # print() writes the message and the newline separately, so allow two chunks per line
+    log: deque[str] = deque(maxlen=EXPORT_OUTPUT_MAX_LINES * 2)
+    try:
+        with _capture_job_output(log):
+            result = ls.run_export(
+                access_token=access_token,
+                refresh_token=refresh_token,
+                client_id=_LS_CLIENT_ID,
+                client_secret=_LS_CLIENT_SECRET,
+                account_id=row["account_id"],
+                airtable_key=_airtable_key_from_bundle(row),
+                base_id=row["airtable_base_id"],
+                field_ids=_selected_fields_from_row(row),
+                category_id=None if category_id.upper() == "ALL" else category_id,
+                listing_filters=listing_filters,
+                # A new table per export; push uses the table id (avoids 403 on a missing "Items")
+                create_new_table=True,
+                # Mid-export refreshes are shared with (and stored like) every other refresh of this connection
+                token_refresher=_session_refresher(row["id"]),
+            )
+    except ls.LightspeedAuthError as e:
+        return {"success": False, "output": "".join(log), "error": str(e)}
+    except Exception as e:
+        return {"success": False, "output": "".join(log), "error": f"Export failed: {e}"}
+    base_id = (row["airtable_base_id"] or "").strip()
+    table_id = result["table_id"]
+    if base_id and table_id:
+        airtable_url = f"https://airtable.com/{base_id}/{table_id}"
+    elif base_id:
+        airtable_url = f"https://airtable.com/{base_id}"
+    else:
+        airtable_url = None
+    return {"success": True, "output": "".join(log), "airtable_url": airtable_url}
+
+
+# Stored job outcomes are kept this long
+EXPORT_JOB_RETENTION_SEC = 86400
+
+
+def _run_and_record_export_job(job_id: str, row: sqlite3.Row, category_id: str, listing_filters: dict) -> dict:
+    try:
+        result = _run_export_job(row, category_id, listing_filters)
+    except Exception as e:
+        result = {"success": False, "error": str(e)}
+    _get_db().execute(
+        "UPDATE export_jobs SET status = 'done', result = ? WHERE id = ?", (_json_dumps(result), job_id)
+    )
+    return result
+
+
+# Running jobs by (connection, category, filters): a repeated click joins the export already running
+_export_inflight: dict[tuple[str, str, str], str] = {}
+
+
+def _submit_export_job(row: sqlite3.Row, category_id: str, listing_filters: dict) -> str:
+    """Queue an export and return its job id, or the id of the identical export already running (unless
+    that one is past EXPORT_TIMEOUT_SEC). Finished jobs older than the export timeout are dropped from memory; their stored outcome stays in
+    export_jobs for EXPORT_JOB_RETENTION_SEC."""
+    inflight_key = (row["id"], category_id, json.dumps(listing_filters or {}, sort_keys=True))
+    with _export_jobs_lock:
+        running_id = _export_inflight.get(inflight_key)
+        if running_id is not None:
+            entry = _export_jobs.get(running_id)
+            # Past the timeout polls report the job as timed out, so a retry starts a fresh export
+            # instead of joining the hung one (its _done leaves the newer inflight entry alone)
+            if entry is None or time.monotonic() - entry[0] <= EXPORT_TIMEOUT_SEC:
+                return running_id
+        job_id = secrets.token_urlsafe(16)
+        _export_inflight[inflight_key] = job_id
+    try:
+        _start_export_job(job_id, row, category_id, listing_filters, inflight_key)
+    except BaseException:
+        with _export_jobs_lock:
+            _export_inflight.pop(inflight_key, None)
+        raise
+    return job_id
+
+
+def _start_export_job(
+    job_id: str, row: sqlite3.Row, category_id: str, listing_filters: dict, inflight_key: tuple
+) -> None:
+    now = time.monotonic()
+    cutoff = _utc_timestamp(datetime.now(timezone.utc) - timedelta(seconds=EXPORT_JOB_RETENTION_SEC))
+    with _tx() as conn:
+        conn.execute("DELETE FROM export_jobs WHERE created_at < ?", (cutoff,))
+        conn.execute(
+            "INSERT INTO export_jobs (id, connection_id, status, created_at) VALUES (?, ?, 'running', ?)",
+            (job_id, row["id"], _utc_timestamp()),
+        )
+    future = _export_executor.submit(_run_and_record_export_job, job_id, row, category_id, listing_filters)
+    with _export_jobs_lock:
+        for old_id, (started, fut) in list(_export_jobs.items()):
+            if fut.done() and now - started > EXPORT_TIMEOUT_SEC:
+                del _export_jobs[old_id]
+        _export_jobs[job_id] = (now, future)
+
+    def _done(_fut: Future) -> None:
+        with _export_jobs_lock:
+            if _export_inflight.get(inflight_key) == job_id:
+                del _export_inflight[inflight_key]
+
+    future.add_done_callback(_done)
+
+
 @app.route("/api/run", methods=["OPTIONS"])
 def api_run_options():
     return "", 204
@@ -316,6 +986,7 @@ def api_run_options():
 
 @app.route("/api/run", methods=["POST"])
 def api_run():
+    """Validate the request and queue the export. Returns {"job_id"}; poll GET /api/run/<job_id> for the result."""
     data = request.get_json() or {}
     connection_id = (data.get("connection_id") or "").strip()
     category_id = (data.get("category_id") or "").strip() or "ALL"
@@ -327,70 +998,67 @@ def api_run():
         listing_filters["qoh_zero"] = "off"
     if not connection_id:
         return jsonify({"success": False, "error": "Missing connection_id. Add your connection key in the extension options."}), 200
-    try:
-        access_token, refresh_token = _ensure_fresh_tokens(connection_id)
-    except ValueError as e:
-        return jsonify({"success": False, "error": str(e)}), 200
-    row = _get_connection(connection_id)
+    row = _load_connection_bundle(connection_id)
     if not row:
         return jsonify({"success": False, "error": "Connection not found. Reconnect at /connect."}), 200
-    client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-    client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
+    client_id = _LS_CLIENT_ID
+    client_secret = _LS_CLIENT_SECRET
     if not client_id or not client_secret:
         return jsonify({"success": False, "error": "Server misconfigured (missing client credentials)."}), 200
-    airtable_key = _get_airtable_key_for_connection(connection_id)
-    if not airtable_key:
+    if not _airtable_key_from_bundle(row):
         return jsonify({"success": False, "error": "No Airtable API key. Use an existing store key or upload your own when you connect, or add your key in extension settings."}), 200
-    selected = _get_selected_fields(connection_id)
-    env = {
-        **os.environ,
-        "LIGHTSPEED_ACCESS_TOKEN": access_token,
-        "LIGHTSPEED_REFRESH_TOKEN": refresh_token,
-        "LIGHTSPEED_ACCOUNT_ID": row["account_id"],
-        "AIRTABLE_API_KEY": airtable_key,
-        "AIRTABLE_BASE_ID": row["airtable_base_id"],
-        "AIRTABLE_TABLE_NAME": row["airtable_table_name"],
-        "AIRTABLE_CREATE_NEW_TABLE": "1",  # create a new table per export; push uses table ID (avoids 403 on missing "Items")
-        "AIRTABLE_FIELDS": ",".join(selected),
-        "FROM_EXPORT_BACKEND": "1",  # script skips opening browser; extension opens the tab
-    }
-    if listing_filters:
-        env["EXPORT_LISTING_FILTERS"] = json.dumps(listing_filters)
-    cmd = [sys.executable, str(SCRIPT_DIR / "lightspeed_export.py")]
-    if category_id.upper() != "ALL":
-        cmd.extend(["--category-id", category_id])
+    job_id = _submit_export_job(row, category_id, listing_filters)
+    return jsonify({"success": True, "status": "running", "job_id": job_id}), 202
+
+
+def _stored_export_job_status(job_id: str):
+    """Status of a job this process isn't tracking (restarted since, or dropped from memory)."""
+    stored = _get_db().execute("SELECT status, result FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+    if not stored:
+        return jsonify({"success": False, "status": "done", "error": "Export job not found. Run the export again."}), 200
+    if stored["status"] != "done" or not stored["result"]:
+        return jsonify({
+            "success": False,
+            "status": "done",
+            "job_id": job_id,
+            "error": "The export was interrupted by a server restart. Run the export again.",
+        }), 200
+    return jsonify({**_json_loads(stored["result"]), "status": "done", "job_id": job_id})
+
+
+@app.route("/api/run/<job_id>", methods=["GET"])
+def api_run_status(job_id: str):
+    """Status of a queued export: {"status": "running"} or {"status": "done", success, airtable_url, error, output}."""
+    with _export_jobs_lock:
+        entry = _export_jobs.get(job_id)
+    if not entry:
+        return _stored_export_job_status(job_id)
+    started, future = entry
+    if not future.done():
+        # A job thread can't be killed; past the limit the extension stops waiting on it
+        if time.monotonic() - started > EXPORT_TIMEOUT_SEC:
+            return jsonify({"success": False, "status": "done", "job_id": job_id, "error": "Export timed out"})
+        return jsonify({"success": True, "status": "running", "job_id": job_id})
     try:
-        result = subprocess.run(
-            cmd,
-            cwd=str(SCRIPT_DIR),
-            capture_output=True,
-            text=True,
-            timeout=3600,
-            env=env,
-        )
-        out = (result.stdout or "") + (result.stderr or "")
-        if result.returncode != 0:
-            return jsonify({"success": False, "output": out, "error": "Export failed"}), 200
-        base_id = (row["airtable_base_id"] or "").strip()
-        table_match = re.search(r"AIRTABLE_TABLE_ID=(tbl[\w]+)", out)
-        table_id = table_match.group(1) if table_match else None
-        if base_id and table_id:
-            airtable_url = f"https://airtable.com/{base_id}/{table_id}"
-        elif base_id:
-            airtable_url = f"https://airtable.com/{base_id}"
-        else:
-            airtable_url = None
-        return jsonify({"success": True, "output": out, "airtable_url": airtable_url})
-    except subprocess.TimeoutExpired:
-        return jsonify({"success": False, "error": "Export timed out"}), 200
+        result = future.result()
     except Exception as e:
-        return jsonify({"success": False, "error": str(e)}), 200
+        result = {"success": False, "error": str(e)}
+    return jsonify({**result, "status": "done", "job_id": job_id})
 
 
 # ----- Gallery (printable / PDF-friendly view) -----
 
+_gallery_secret_bytes: bytes | None = None
+
+
 def _gallery_share_secret() -> bytes:
-    """Secret for signing gallery share tokens. Use GALLERY_SHARE_SECRET or FLASK_SECRET_KEY in production so share links work across workers/restarts."""
+    """Secret for signing gallery share tokens. Use GALLERY_SHARE_SECRET or FLASK_SECRET_KEY in production so share links work across workers/restarts.
+
+    Derived once on first use; the inputs don't change while the process runs.
+    """
+    global _gallery_secret_bytes
+    if _gallery_secret_bytes is not None:
+        return _gallery_secret_bytes
     raw = (
         (os.environ.get("GALLERY_SHARE_SECRET") or "").strip()
         or (os.environ.get("FLASK_SECRET_KEY") or "").strip()
@@ -398,21 +1066,80 @@ def _gallery_share_secret() -> bytes:
     )
     if isinstance(raw, bytes):
         raw = raw.decode("latin-1")
-    return hashlib.sha256((raw or "fallback").encode()).digest()
+    _gallery_secret_bytes = hashlib.sha256((raw or "fallback").encode()).digest()
+    return _gallery_secret_bytes
+
+
+# Share tokens carry a SHA-256 HMAC truncated to 128 bits
+_SHARE_MAC_LEN = 16
 
 
 def _create_gallery_share_token(connection_id: str, category_id: str | None) -> str:
-    """Create a signed token that locks the gallery to this connection and category (or ALL)."""
-    payload = connection_id + "|" + (category_id or "ALL")
-    payload_b64 = base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
-    sig = hmac.new(_gallery_share_secret(), payload.encode(), hashlib.sha256).hexdigest()
-    return payload_b64 + "." + sig
+    """Create a signed token that locks the gallery to this connection and category (or ALL).
+
+    The token is one unpadded urlsafe-base64 blob: payload bytes followed by the truncated MAC.
+    """
+    payload = (connection_id + "|" + (category_id or "ALL")).encode()
+    mac = hmac.digest(_gallery_share_secret(), payload, "sha256")[:_SHARE_MAC_LEN]
+    return base64.urlsafe_b64encode(payload + mac).decode().rstrip("=")
+
+
+def _csv_filters_sig(share_token: str, listing_filters: dict) -> str:
+    """MAC binding the filters in a gallery CSV link to its share token. The token only covers
+    (connection, category), so without this any filter set could be requested, each a fresh walk."""
+    msg = (share_token + "|" + json.dumps(listing_filters, sort_keys=True, separators=(",", ":"))).encode()
+    return hmac.digest(_gallery_share_secret(), msg, "sha256")[:_SHARE_MAC_LEN].hex()
+
+
+# Verified share tokens, keyed by a hash of the token so raw tokens aren't kept in memory.
+# Rejections are remembered for less time, and in a smaller cache, than successes.
+_share_token_cache = _TTLCache(300, maxsize=4096)
+_bad_share_token_cache = _TTLCache(30, maxsize=1024)
 
 
 def _verify_gallery_share_token(token: str) -> tuple[str, str] | None:
     """Verify token and return (connection_id, category_id_or_ALL) or None."""
-    if not token or "." not in token:
+    if not token:
+        return None
+    token_hash = hashlib.sha256(token.encode()).digest()
+    parsed = _share_token_cache.get(token_hash)
+    if parsed is not None:
+        return parsed
+    if _bad_share_token_cache.get(token_hash):
+        return None
+    parsed = _check_gallery_share_token(token)
+    if parsed is None:
+        _bad_share_token_cache.set(token_hash, True)
+    else:
+        _share_token_cache.set(token_hash, parsed)
+    return parsed
+
+
+def _check_gallery_share_token(token: str) -> tuple[str, str] | None:
+    if "." in token:
+        return _verify_legacy_gallery_share_token(token)
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except Exception:
+        return None
+    payload, mac = raw[:-_SHARE_MAC_LEN], raw[-_SHARE_MAC_LEN:]
+    if len(mac) != _SHARE_MAC_LEN:
+        return None
+    expected = hmac.digest(_gallery_share_secret(), payload, "sha256")[:_SHARE_MAC_LEN]
+    if not hmac.compare_digest(expected, mac):
+        return None
+    try:
+        payload_str = payload.decode()
+    except UnicodeDecodeError:
         return None
+    if "|" not in payload_str:
+        return None
+    conn_id, cat_id = payload_str.split("|", 1)
+    return (conn_id.strip(), cat_id.strip() or "ALL")
+
+
+def _verify_legacy_gallery_share_token(token: str) -> tuple[str, str] | None:
+    """Verify the older "<payload_b64>.<hex sig>" share tokens so links already handed out keep working."""
     payload_b64, sig = token.rsplit(".", 1)
     try:
         payload = base64.urlsafe_b64decode(payload_b64 + "==").decode()
@@ -420,7 +1147,7 @@ def _verify_gallery_share_token(token: str) -> tuple[str, str] | None:
         return None
     if "|" not in payload:
         return None
-    expected = hmac.new(_gallery_share_secret(), payload.encode(), hashlib.sha256).hexdigest()
+    expected = hmac.digest(_gallery_share_secret(), payload.encode(), "sha256").hex()
     if not hmac.compare_digest(expected, sig):
         return None
     conn_id, cat_id = payload.split("|", 1)
@@ -733,18 +1460,19 @@ GALLERY_HTML = """<!DOCTYPE html>
     </div>
   </div>
   <div class="gallery" id="gallery-grid">
-    {% for item in items %}
+    {% for values, image_urls_raw in items %}
+    {% set image_urls = image_urls_raw | image_url_list %}
     <div class="card" data-card-index="{{ loop.index0 }}">
       <div class="card-image-wrap">
-        {% if item.image_urls_list %}
+        {% if image_urls %}
         <div class="card-carousel-inner">
-          {% for url in item.image_urls_list %}
+          {% for url in image_urls %}
           <div class="card-carousel-slide {{ 'active' if loop.first else '' }}" data-slide-index="{{ loop.index0 }}">
-            <img src="{{ url }}" alt="" loading="lazy">
+            {% if loop.first %}<img src="{{ url }}" alt="" loading="lazy">{% else %}<img data-src="{{ url }}" alt="">{% endif %}
           </div>
           {% endfor %}
         </div>
-        {% if item.image_urls_list|length > 1 %}
+        {% if image_urls|length > 1 %}
         <div class="card-carousel-nav" aria-hidden="true">
           <button type="button" class="carousel-prev" title="Previous image">&lsaquo;</button>
           <button type="button" class="carousel-next" title="Next image">&rsaquo;</button>
@@ -755,12 +1483,9 @@ GALLERY_HTML = """<!DOCTYPE html>
         {% endif %}
       </div>
       <div class="card-details">
-        {% for field in fields %}
-        {% if field.rowKey != 'image_urls' and field.rowKey != 'image' %}
-        {% set val = item.get(field.rowKey) %}
+        {% for val in values %}
         {% if val is not none and val != '' %}
-        <div class="card-detail"><span class="label">{{ field.displayName }}:</span> {{ val }}</div>
-        {% endif %}
+        <div class="card-detail"><span class="label">{{ labels[loop.index0] }}:</span> {{ val }}</div>
         {% endif %}
         {% endfor %}
       </div>
@@ -770,8 +1495,7 @@ GALLERY_HTML = """<!DOCTYPE html>
   {% if share_url %}
   <script>
     window.GALLERY_SHARE_URL = {{ share_url | tojson }};
-    window.GALLERY_ITEMS = {{ items | tojson }};
-    window.GALLERY_FIELDS = {{ fields | tojson }};
+    window.GALLERY_CSV_URL = {{ csv_url | tojson }};
   </script>
   {% endif %}
   <script>
@@ -787,6 +1511,9 @@ GALLERY_HTML = """<!DOCTYPE html>
       var current = 0;
       function goTo(i) {
         current = (i + n) % n;
+        // Only the first slide's image is loaded up front; fetch the others when first shown
+        var img = slides[current].querySelector('img');
+        if (img && !img.getAttribute('src') && img.dataset.src) img.src = img.dataset.src;
         slides.forEach(function(s, j) { s.classList.toggle('active', j === current); });
       }
       prevBtn.addEventListener('click', function() { goTo(current - 1); });
@@ -824,24 +1551,8 @@ GALLERY_HTML = """<!DOCTYPE html>
             });
           } else if (action === 'print') {
             window.print();
-          } else if (action === 'csv' && window.GALLERY_ITEMS && window.GALLERY_FIELDS) {
-            var fields = window.GALLERY_FIELDS.filter(function(f) { return f.rowKey !== 'image_urls' && f.rowKey !== 'image'; });
-            var header = fields.map(function(f) { return '"' + (f.displayName || f.rowKey || '').replace(/"/g, '""') + '"'; }).join(',');
-            var rows = window.GALLERY_ITEMS.map(function(item) {
-              return fields.map(function(f) {
-                var v = item[f.rowKey];
-                if (v == null) v = '';
-                v = String(v).replace(/"/g, '""');
-                return '"' + v + '"';
-              }).join(',');
-            });
-            var csv = [header].concat(rows).join("\\n");
-            var blob = new Blob([csv], { type: 'text/csv;charset=utf-8' });
-            var a = document.createElement('a');
-            a.href = URL.createObjectURL(blob);
-            a.download = 'gallery-export.csv';
-            a.click();
-            URL.revokeObjectURL(a.href);
+          } else if (action === 'csv' && window.GALLERY_CSV_URL) {
+            window.location = window.GALLERY_CSV_URL;
           }
         });
       });
@@ -877,23 +1588,159 @@ GALLERY_SHARE_ERROR_HTML = """<!DOCTYPE html>
 </html>
 """
 
+_IMG_SPLIT = re.compile(r"\s*\|\s*")
+
+
+def _image_url_list(raw) -> list[str]:
+    """Split a row's "|"-separated image_urls. Used per card while the gallery streams, so the
+    cached rows never carry a second copy of every URL."""
+    return [u for u in _IMG_SPLIT.split((raw or "").strip()) if u]
+
+
+# Must be registered before the templates below are compiled
+app.jinja_env.filters["image_url_list"] = _image_url_list
+
+
+def _template_bytecode_cache():
+    """Compiled template bytecode kept on disk so a fresh worker skips the Jinja compile step.
+    Set JINJA_BYTECODE_CACHE_DIR to move it; an unwritable directory just disables the cache."""
+    cache_dir = Path(
+        os.environ.get("JINJA_BYTECODE_CACHE_DIR")
+        or Path(tempfile.gettempdir()) / "lightspeed-export-jinja"
+    )
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return FileSystemBytecodeCache(str(cache_dir))
+
+
+# Page templates are compiled once at import; render_template_string would re-parse them on every
+# request. The overlay shares app.jinja_env's filters, policies and autoescaping (names end in .html)
+# but never checks the sources for changes: they are module constants. None of them use Flask's
+# context processors (request, url_for, ...), so plain .render() is enough.
+_TEMPLATE_SOURCES: dict[str, str] = {}
+_templates_env = app.jinja_env.overlay(
+    loader=DictLoader(_TEMPLATE_SOURCES),
+    auto_reload=False,
+    bytecode_cache=_template_bytecode_cache(),
+)
+
+
+def _compile_template(name: str, source: str):
+    _TEMPLATE_SOURCES[name] = source
+    return _templates_env.get_template(name)
+
+
+_GALLERY_TMPL = _compile_template("gallery.html", GALLERY_HTML)
+_GALLERY_LOADING_TMPL = _compile_template("gallery_loading.html", GALLERY_LOADING_HTML)
+# Pages with no template variables are encoded once and sent as-is
+_GALLERY_ERROR_BYTES = GALLERY_ERROR_HTML.encode("utf-8")
+_GALLERY_SHARE_ERROR_BYTES = GALLERY_SHARE_ERROR_HTML.encode("utf-8")
+
+
+def _html_response(body, status: int = 200, cache_control: str = "no-store") -> Response:
+    """HTML response with an explicit Cache-Control (default no-store: most pages depend on a key or token)."""
+    resp = Response(body, status=status, mimetype="text/html")
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
+
+# Loaded gallery data (rows, fields, title) is reused briefly so refreshes, share-link viewers
+# and the CSV download don't each walk the whole Lightspeed catalog again.
+GALLERY_CACHE_TTL_SEC = 120
+_gallery_cache = _TTLCache(GALLERY_CACHE_TTL_SEC, maxsize=64)
+# Loads currently running, by cache key: concurrent requests for the same gallery wait on one walk
+GALLERY_LOAD_WAIT_SEC = 300
+_gallery_inflight: dict[str, Future] = {}
+_gallery_inflight_lock = threading.Lock()
+
+
+def _gallery_cache_key(key: str, category_id: str | None, listing_filters: dict | None, selected: list[str]) -> str:
+    """Selected fields are part of the key, so saving new settings never serves old columns."""
+    raw = "|".join(
+        (key, category_id or "ALL", json.dumps(listing_filters or {}, sort_keys=True), ",".join(selected))
+    )
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+# One Lightspeed session per connection, so gallery loads reuse its keep-alive connections instead
+# of a new TLS handshake each time. Concurrent walks share it, so it is never handed a request's own
+# (possibly older) row: when that row differs, the session re-reads the DB under its refresh lock.
+LIGHTSPEED_SESSION_TTL_SEC = 3600
+_lightspeed_sessions = _TTLCache(LIGHTSPEED_SESSION_TTL_SEC, maxsize=256)
+
+
+def _lightspeed_session(conn_id: str, access_token: str, refresh_token: str) -> ls.SessionWithRefresh:
+    session = _lightspeed_sessions.get(conn_id)
+    if session is not None:
+        if session.tokens != (access_token, refresh_token):
+            session.adopt_tokens(lambda: _stored_tokens(conn_id))
+        return session
+    session = ls.SessionWithRefresh(
+        access_token, refresh_token, _LS_CLIENT_ID, _LS_CLIENT_SECRET, _session_refresher(conn_id)
+    )
+    _lightspeed_sessions.set(conn_id, session)
+    return session
+
+
+@functools.lru_cache(maxsize=256)
+def _gallery_fields(selected: tuple[str, ...]) -> list[dict]:
+    """Fields shown as text on gallery cards and in the CSV (images are shown, not listed)."""
+    return [f for f in ls._fields_for_ids(list(selected)) if f["rowKey"] not in ("image_urls", "image")]
+
 
 def _get_gallery_data(
     key: str,
     category_id: str | None,
     listing_filters: dict | None = None,
-) -> tuple[list[dict], list[dict], str]:
-    """Load gallery rows, fields, and title for the given connection and category. Raises on error."""
+) -> tuple[list[tuple[list, str]], list[dict], str]:
+    """Load gallery cards, fields, and title for the given connection and category. Raises on error.
+
+    Each card is (values, image_urls): values line up with fields, image_urls is the raw "|"-joined string.
+
+    Results are cached for GALLERY_CACHE_TTL_SEC; callers must not mutate them.
+    """
     row = _get_connection(key)
     if not row:
         raise ValueError("Connection not found")
-    access_token, refresh_token = _ensure_fresh_tokens(key)
-    client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-    client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
-    if not client_id or not client_secret:
+    selected = _selected_fields_from_row(row)
+    cache_key = _gallery_cache_key(key, category_id, listing_filters, selected)
+    with _gallery_inflight_lock:
+        cached = _gallery_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        pending = _gallery_inflight.get(cache_key)
+        if pending is None:
+            future: Future = Future()
+            _gallery_inflight[cache_key] = future
+    if pending is not None:
+        return pending.result(timeout=GALLERY_LOAD_WAIT_SEC)
+    try:
+        result = _load_gallery_data(row, category_id, listing_filters, selected)
+        _gallery_cache.set(cache_key, result)
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        with _gallery_inflight_lock:
+            _gallery_inflight.pop(cache_key, None)
+    return result
+
+
+def _load_gallery_data(
+    row: sqlite3.Row,
+    category_id: str | None,
+    listing_filters: dict | None,
+    selected: list[str],
+) -> tuple[list[tuple[list, str]], list[dict], str]:
+    """Walk Lightspeed for one gallery. Called by _get_gallery_data, at most once per cache key at a time."""
+    access_token, refresh_token = _ensure_fresh_tokens(row)
+    if not _LS_CLIENT_ID or not _LS_CLIENT_SECRET:
         raise ValueError("Server misconfigured")
-    session = ls.SessionWithRefresh(access_token, refresh_token, client_id, client_secret)
-    selected = _get_selected_fields(key)
+    session = _lightspeed_session(row["id"], access_token, refresh_token)
     rows = ls.export_items(
         session,
         row["account_id"],
@@ -902,18 +1749,46 @@ def _get_gallery_data(
         category_id=category_id,
         field_ids=selected,
         listing_filters=listing_filters or {},
+        selected_columns_only=True,
     )
-    for r in rows:
-        r["image_urls_list"] = [u.strip() for u in (r.get("image_urls") or "").split("|") if u.strip()]
-    fields = ls._fields_for_ids(selected)
+    fields = _gallery_fields(tuple(selected))
+    # Project rows to positional values once, so rendering and CSV don't do per-field dict lookups
+    # (and the cache doesn't hold every column Lightspeed returned)
+    row_keys = [f["rowKey"] for f in fields]
+    cards = [([r.get(k) for k in row_keys], r.get("image_urls") or "") for r in rows]
     if category_id:
         try:
+            # Cached per (account, category) inside the export module, shared with export jobs
             title = ls.get_category_name(session, row["account_id"], category_id) or f"Category {category_id}"
         except Exception:
             title = f"Category {category_id}"
     else:
         title = "All items"
-    return (rows, fields, title)
+    return (cards, fields, title)
+
+
+def _arg(name: str) -> str:
+    """Stripped query-string value, "" when missing."""
+    value = request.args.get(name)
+    return value.strip() if value else ""
+
+
+def _form(name: str) -> str:
+    """Stripped form value, "" when missing."""
+    value = request.form.get(name)
+    return value.strip() if value else ""
+
+
+def _listing_filters_arg() -> dict:
+    """Parse the listing_filters query arg (JSON object); {} if missing or invalid."""
+    raw = _arg("listing_filters")
+    if not raw:
+        return {}
+    try:
+        parsed = _json_loads(raw)
+    except (ValueError, TypeError):
+        return {}
+    return parsed if isinstance(parsed, dict) else {}
 
 
 def _render_gallery_full(
@@ -921,108 +1796,143 @@ def _render_gallery_full(
     category_id: str | None,
     listing_filters: dict,
     share_url: str | None = None,
-) -> str:
-    """Load gallery data and return full gallery HTML. Used by /gallery/full."""
-    row = _get_connection(key)
-    if not row:
-        return ""
-    access_token, refresh_token = _ensure_fresh_tokens(key)
-    client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-    client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
-    if not client_id or not client_secret:
-        return ""
-    rows, fields, title = _get_gallery_data(key, category_id, listing_filters=listing_filters)
-    return render_template_string(
-        GALLERY_HTML, items=rows, fields=fields, title=title, share_url=share_url or ""
+    csv_url: str | None = None,
+) -> Response:
+    """Load gallery data and return a streamed gallery HTML response. Used by /gallery/full.
+
+    Data is loaded before streaming starts, so load errors (ValueError for a missing connection,
+    expired sign-in or missing server credentials) still raise here.
+    """
+    cards, fields, title = _get_gallery_data(key, category_id, listing_filters=listing_filters)
+    stream = _GALLERY_TMPL.stream(
+        items=cards, labels=[f["displayName"] for f in fields], title=title, share_url=share_url or "", csv_url=csv_url or ""
     )
+    return Response(stream_with_context(stream), mimetype="text/html")
 
 
 @app.route("/gallery")
 def gallery_page():
     """Returns loading shell immediately; client fetches /gallery/full for actual content."""
-    key = (request.args.get("key") or "").strip()
+    key = _arg("key")
     if not key:
         return redirect(url_for("connect_page"))
     if not _get_connection(key):
         return redirect(url_for("connect_page"))
-    return render_template_string(
-        GALLERY_LOADING_HTML,
-        share_token=None,
-    )
+    return _html_response(_GALLERY_LOADING_TMPL.render(share_token=None))
 
 
 @app.route("/gallery/full")
 def gallery_full():
     """Heavy gallery render (called by loading page via fetch)."""
-    key = (request.args.get("key") or "").strip()
-    share_token = (request.args.get("share_token") or "").strip()
+    key = _arg("key")
+    share_token = _arg("share_token")
     if share_token:
         parsed = _verify_gallery_share_token(share_token)
         if not parsed:
-            return render_template_string(GALLERY_SHARE_ERROR_HTML), 200
+            return _html_response(_GALLERY_SHARE_ERROR_BYTES)
         key, category_param = parsed
         category_id = None if category_param.upper() == "ALL" else category_param
         listing_filters = {}
         share_url = url_for("gallery_share", token=share_token, _external=True)
+        csv_url = url_for("gallery_export_csv", share_token=share_token)
     else:
-        category_id_param = (request.args.get("category_id") or "").strip()
+        category_id_param = _arg("category_id")
         category_id = category_id_param if category_id_param and category_id_param.upper() != "ALL" else None
-        listing_filters = {}
-        try:
-            raw = (request.args.get("listing_filters") or "").strip()
-            if raw:
-                listing_filters = json.loads(raw)
-                if not isinstance(listing_filters, dict):
-                    listing_filters = {}
-        except (json.JSONDecodeError, TypeError):
-            pass
-        if (request.args.get("qoh_positive_only") or "").strip().lower() in ("1", "true", "yes"):
+        listing_filters = _listing_filters_arg()
+        if _arg("qoh_positive_only").lower() in ("1", "true", "yes"):
             listing_filters["qoh_positive"] = "on"
             listing_filters["qoh_zero"] = "off"
-            shop = (request.args.get("shop_id") or "").strip()
+            shop = _arg("shop_id")
             if shop and shop != "-1":
                 listing_filters["shop_id"] = shop
         share_url = None
+        csv_url = None
         try:
             token = _create_gallery_share_token(key, category_id)
             share_url = url_for("gallery_share", token=token, _external=True)
+            csv_url = url_for(
+                "gallery_export_csv",
+                share_token=token,
+                listing_filters=_json_dumps(listing_filters) if listing_filters else None,
+                filters_sig=_csv_filters_sig(token, listing_filters) if listing_filters else None,
+            )
         except Exception:
             pass
     if not key:
         return "Missing key.", 400
     try:
-        html = _render_gallery_full(key, category_id, listing_filters, share_url=share_url)
+        html = _render_gallery_full(key, category_id, listing_filters, share_url=share_url, csv_url=csv_url)
     except ValueError:
         if share_token:
-            return render_template_string(GALLERY_SHARE_ERROR_HTML), 200
-        return render_template_string(GALLERY_ERROR_HTML), 404
+            return _html_response(_GALLERY_SHARE_ERROR_BYTES)
+        return _html_response(_GALLERY_ERROR_BYTES, 404)
     except Exception as e:
         return f"Failed to load items: {e}", 500
-    if not html:
-        if share_token:
-            return render_template_string(GALLERY_SHARE_ERROR_HTML), 200
-        return render_template_string(GALLERY_ERROR_HTML), 404
     return html
 
 
+def _gallery_csv_rows(cards: list[tuple[list, str]], fields: list[dict]):
+    """Yield CSV text for the gallery's fields (every value quoted), one row at a time."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, quoting=csv.QUOTE_ALL, lineterminator="\n")
+    writer.writerow([f.get("displayName") or f["rowKey"] for f in fields])
+    yield buf.getvalue()
+    for values, _image_urls in cards:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow(["" if v is None else v for v in values])
+        yield buf.getvalue()
+
+
+@app.route("/gallery/export.csv")
+def gallery_export_csv():
+    """CSV of a shared gallery, built server-side so the gallery page doesn't embed every item as JSON."""
+    share_token = _arg("share_token")
+    parsed = _verify_gallery_share_token(share_token)
+    if not parsed:
+        return _html_response(_GALLERY_SHARE_ERROR_BYTES)
+    key, category_param = parsed
+    category_id = None if category_param.upper() == "ALL" else category_param
+    listing_filters = _listing_filters_arg()
+    # Only the filters the gallery view signed into this link are accepted
+    if listing_filters and not hmac.compare_digest(
+        _arg("filters_sig").encode(), _csv_filters_sig(share_token, listing_filters).encode()
+    ):
+        return _html_response(_GALLERY_SHARE_ERROR_BYTES)
+    try:
+        cards, fields, _title = _get_gallery_data(key, category_id, listing_filters=listing_filters)
+    except ValueError:
+        return _html_response(_GALLERY_SHARE_ERROR_BYTES)
+    except Exception as e:
+        return f"Failed to load items: {e}", 500
+    return Response(
+        _gallery_csv_rows(cards, fields),
+        mimetype="text/csv",
+        headers={"Content-Disposition": 'attachment; filename="gallery-export.csv"'},
+    )
+
+
 @app.route("/gallery/s/<token>")
 def gallery_share(token: str):
     """Returns loading shell; client fetches /gallery/full?share_token= for actual content."""
     parsed = _verify_gallery_share_token(token)
     if not parsed:
-        return render_template_string(GALLERY_ERROR_HTML), 404
+        return _html_response(_GALLERY_ERROR_BYTES, 404)
     if not _get_connection(parsed[0]):
-        return render_template_string(GALLERY_ERROR_HTML), 404
-    return render_template_string(
-        GALLERY_LOADING_HTML,
-        share_token=token,
-    )
+        return _html_response(_GALLERY_ERROR_BYTES, 404)
+    return _html_response(_GALLERY_LOADING_TMPL.render(share_token=token))
 
 
 # ----- Connect (multi-tenant OAuth + setup) -----
 
-def _oauth_redirect_uri() -> str:
-    """Redirect URI for OAuth. Use HTTPS (Lightspeed only allows https)."""
+def _auth_url(state: str, redirect_uri: str) -> str:
+    return _AUTH_URL_TEMPLATE.format_map(
+        {"state": quote(state, safe=""), "redirect_uri": quote(redirect_uri, safe="")}
+    )
+
+
+def _configured_redirect_uri() -> str:
+    """Redirect URI from LIGHTSPEED_REDIRECT_URI or BACKEND_PUBLIC_URL, or "" to derive it per request."""
     uri = (os.environ.get("LIGHTSPEED_REDIRECT_URI") or "").strip()
     if uri:
         if not uri.startswith("http://") and not uri.startswith("https://"):
@@ -1033,6 +1943,17 @@ def _oauth_redirect_uri() -> str:
         if not base.startswith("http://") and not base.startswith("https://"):
             base = "https://" + base
         return f"{base}/connect/callback"
+    return ""
+
+
+# The environment doesn't change while the process runs
+_REDIRECT_URI_OVERRIDE = _configured_redirect_uri()
+
+
+def _oauth_redirect_uri() -> str:
+    """Redirect URI for OAuth. Use HTTPS (Lightspeed only allows https)."""
+    if _REDIRECT_URI_OVERRIDE:
+        return _REDIRECT_URI_OVERRIDE
     # Behind a proxy (e.g. Railway): use X-Forwarded headers so we get https and correct host
     try:
         proto = (request.headers.get("X-Forwarded-Proto") or "https").strip().lower() or "https"
@@ -1047,25 +1968,24 @@ def _oauth_redirect_uri() -> str:
     return root + "/connect/callback"
 
 
+_BASE_ID_RE = re.compile(r"app[A-Za-z0-9_]{11,}")
+# Base id as a path segment of an airtable.com URL, e.g. https://airtable.com/appXXX/tblYYY?blocks=hide
+_URL_BASE_ID_RE = re.compile(r"/(app[A-Za-z0-9_]{11,})(?=[/?#]|$)")
+
+
 def _extract_airtable_base_id(value: str) -> str | None:
     """Extract Airtable base ID from a full URL or return the value if it's already a base ID."""
     value = (value or "").strip()
     if not value:
         return None
     # Already looks like a base ID (app + alphanumeric)
-    if value.startswith("app") and len(value) >= 14 and value[3:].replace("_", "").isalnum():
+    if _BASE_ID_RE.fullmatch(value):
         return value
-    # Try to parse as URL (e.g. https://airtable.com/appXXX/... or https://airtable.com/appXXX)
+    # URL (e.g. https://airtable.com/appXXX/... or airtable.com/appXXX)
     if "airtable.com" in value:
-        try:
-            parsed = urlparse(value if "://" in value else "https://" + value)
-            path = (parsed.path or "").strip("/")
-            segments = [s for s in path.split("/") if s]
-            for seg in segments:
-                if seg.startswith("app") and len(seg) >= 14:
-                    return seg
-        except Exception:
-            pass
+        m = _URL_BASE_ID_RE.search(value)
+        if m:
+            return m.group(1)
     return None
 
 
@@ -1094,7 +2014,7 @@ CONNECT_HTML = """
 </head>
 <body>
   <h1>Connect your Lightspeed & Airtable</h1>
-  {% if error %}<p class="error">{{ error }}</p>{% endif %}
+  <!--error-->
   <p class="muted">You must use an Airtable API key to connect. Choose one: <strong>use an existing store key</strong> (from the dropdown) or <strong>upload your own</strong> key. You only need to do this once. Exports will create new tables in the Airtable base you link.</p>
 
   <div class="connect-option">
@@ -1437,39 +2357,67 @@ PRIVACY_POLICY_HTML = """<!DOCTYPE html>
 </html>
 """
 
+_CONNECT_TMPL = _compile_template("connect.html", CONNECT_HTML)
+_RECONNECT_TMPL = _compile_template("reconnect.html", RECONNECT_HTML)
+_CONNECT_ENTER_DETAILS_TMPL = _compile_template("connect_enter_details.html", CONNECT_ENTER_DETAILS_HTML)
+_SHARED_KEY_CREATE_TMPL = _compile_template("shared_key_create.html", SHARED_KEY_CREATE_HTML)
+_CONNECT_PASTE_TMPL = _compile_template("connect_paste.html", CONNECT_PASTE_HTML)
+_SUCCESS_TMPL = _compile_template("success.html", SUCCESS_HTML)
+_SETTINGS_TMPL = _compile_template("settings.html", SETTINGS_HTML)
+_PRIVACY_POLICY_BYTES = PRIVACY_POLICY_HTML.encode("utf-8")
+
+
+_INDEX_BODY = _json_dumps({
+    "ok": True,
+    "message": "Lightspeed → Airtable backend (multi-tenant). Use /connect to connect your account; use the extension with your connection key.",
+}).encode()
+
 
 @app.route("/")
 def index():
-    return jsonify({
-        "ok": True,
-        "message": "Lightspeed → Airtable backend (multi-tenant). Use /connect to connect your account; use the extension with your connection key.",
-    }), 200
+    # Health checks hit this: never cached, so a proxy can't report "up" for a backend that has died
+    resp = Response(_INDEX_BODY, mimetype="application/json")
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
 
 
 @app.route("/privacy")
 def privacy_page():
-    return render_template_string(PRIVACY_POLICY_HTML)
+    return _html_response(_PRIVACY_POLICY_BYTES, cache_control="public, max-age=3600")
+
+
+_CONNECT_ERROR_SLOT = "<!--error-->"
+
+
+def _connect_page(error: str | None = None) -> str:
+    """The /connect page. The template only varies with the store-key list, so it is rendered once per
+    list and the error message is dropped into its slot."""
+    page = _shared_keys_cache.get("connect_page")
+    if page is None:
+        page = _CONNECT_TMPL.render(shared_keys=_list_shared_keys())
+        _shared_keys_cache.set("connect_page", page)
+    if not error:
+        return page
+    return page.replace(_CONNECT_ERROR_SLOT, f'<p class="error">{escape(error)}</p>', 1)
 
 
 @app.route("/connect", methods=["GET"])
 def connect_page():
-    key = (request.args.get("key") or "").strip()
+    key = _arg("key")
     if key and _get_connection(key):
         return redirect(url_for("connect_reconnect_page", key=key))
-    shared_keys = _list_shared_keys()
-    return render_template_string(CONNECT_HTML, shared_keys=shared_keys, error=request.args.get("error"))
+    return _connect_page(request.args.get("error"))
 
 
 @app.route("/connect/reconnect", methods=["GET"])
 def connect_reconnect_page():
-    key = (request.args.get("key") or "").strip()
+    key = _arg("key")
     if not key:
         return redirect(url_for("connect_page"))
     row = _get_connection(key)
     if not row:
         return redirect(url_for("connect_page", error="Connection not found. You can start a new connection below."))
-    return render_template_string(
-        RECONNECT_HTML,
+    return _RECONNECT_TMPL.render(
         connection_id=key,
         account_id=row["account_id"] or "",
         airtable_base_id=row["airtable_base_id"] or "",
@@ -1477,9 +2425,59 @@ def connect_reconnect_page():
     )
 
 
+# In-progress connect flows (store-key password, OAuth state, Airtable key) stay server-side;
+# the signed session cookie only carries an opaque id per flow.
+PENDING_FLOW_TTL_SEC = 900
+# /connect/start is unauthenticated, so a full store refuses new flows rather than evicting other
+# users' (their store-key passwords live here until the callback), and each client gets a few at most
+_pending_store = _TTLCache(PENDING_FLOW_TTL_SEC, maxsize=1024)
+PENDING_FLOWS_PER_CLIENT = 8
+_pending_by_client = _TTLCache(PENDING_FLOW_TTL_SEC, maxsize=4096)
+_PENDING_FULL_ERROR = "Too many sign-ins are in progress. Please try again in a few minutes."
+
+
+def _client_addr() -> str:
+    # Behind a proxy (e.g. Railway) the last X-Forwarded-For hop is the one the proxy itself appended
+    forwarded = request.headers.get("X-Forwarded-For") or ""
+    return forwarded.rsplit(",", 1)[-1].strip() or request.remote_addr or ""
+
+
+def _stash_pending(name: str, data: dict) -> bool:
+    """Store data for this browser's flow; False when the store or this client's share of it is full."""
+    old_id = session.get(name)
+    if isinstance(old_id, str):
+        _pending_store.pop(old_id)
+    client = _client_addr()
+    live = [pid for pid in _pending_by_client.get(client) or () if _pending_store.get(pid) is not None]
+    if len(live) >= PENDING_FLOWS_PER_CLIENT:
+        return False
+    pending_id = secrets.token_urlsafe(16)
+    if not _pending_store.add(pending_id, data):
+        return False
+    _pending_by_client.set(client, live + [pending_id])
+    session[name] = pending_id
+    return True
+
+
+def _pending(name: str) -> dict:
+    pending_id = session.get(name)
+    if not isinstance(pending_id, str):
+        return {}
+    return _pending_store.get(pending_id) or {}
+
+
+def _pop_pending(name: str) -> dict | None:
+    pending_id = session.pop(name, None)
+    if not isinstance(pending_id, str):
+        return None
+    data = _pending_store.get(pending_id)
+    _pending_store.pop(pending_id)
+    return data
+
+
 @app.route("/connect/verify-shared-key", methods=["POST"])
 def connect_verify_shared_key():
-    shared_key_id = (request.form.get("shared_key_id") or "").strip()
+    shared_key_id = _form("shared_key_id")
     password = request.form.get("password") or ""
     if not shared_key_id or not password:
         return redirect(url_for("connect_page", error="Choose a store key and enter the password."))
@@ -1487,21 +2485,21 @@ def connect_verify_shared_key():
         return redirect(url_for("connect_page", error="Wrong password for this store key."))
     shared_keys = _list_shared_keys()
     label = next((k["label"] for k in shared_keys if k["id"] == shared_key_id), shared_key_id)
-    session["shared_key_pending"] = {
+    if not _stash_pending("shared_key_pending", {
         "shared_key_id": shared_key_id,
         "shared_key_password": password,
         "shared_key_label": label,
-    }
+    }):
+        return redirect(url_for("connect_page", error=_PENDING_FULL_ERROR))
     return redirect(url_for("connect_enter_details"))
 
 
 @app.route("/connect/enter-details", methods=["GET"])
 def connect_enter_details():
-    pending = session.get("shared_key_pending") or {}
+    pending = _pending("shared_key_pending")
     if not pending.get("shared_key_id"):
         return redirect(url_for("connect_page"))
-    return render_template_string(
-        CONNECT_ENTER_DETAILS_HTML,
+    return _CONNECT_ENTER_DETAILS_TMPL.render(
         shared_key_id=pending["shared_key_id"],
         shared_key_label=pending.get("shared_key_label", "Store key"),
         error=request.args.get("error"),
@@ -1510,7 +2508,7 @@ def connect_enter_details():
 
 @app.route("/connect/start", methods=["POST"])
 def connect_start():
-    reconnect_connection_id = (request.form.get("reconnect_connection_id") or "").strip()
+    reconnect_connection_id = _form("reconnect_connection_id")
     if reconnect_connection_id:
         row = _get_connection(reconnect_connection_id)
         if not row:
@@ -1519,9 +2517,7 @@ def connect_start():
         airtable_base_id = (row["airtable_base_id"] or "").strip()
         airtable_table_name = (row["airtable_table_name"] or "").strip() or "Items"
         airtable_api_key = (row["airtable_api_key"] or "").strip()
-        client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-        client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
-        if not client_id or not client_secret:
+        if not _LS_CLIENT_ID or not _LS_CLIENT_SECRET:
             return redirect(url_for("connect_page", error="Server missing Lightspeed client credentials."))
         redirect_uri = _oauth_redirect_uri()
         state = secrets.token_urlsafe(24)
@@ -1534,133 +2530,152 @@ def connect_start():
             "airtable_api_key": airtable_api_key,
             "reconnect_connection_id": reconnect_connection_id,
         }
-        session["pending_connect"] = pending_connect
-        auth_url = (
-            f"{ls.AUTHORIZE_URL}?response_type=code&client_id={quote(client_id, safe='')}"
-            f"&scope=employee:all&state={quote(state, safe='')}&redirect_uri={quote(redirect_uri, safe='')}"
-        )
+        if not _stash_pending("pending_connect", pending_connect):
+            return redirect(url_for("connect_page", error=_PENDING_FULL_ERROR))
+        auth_url = _auth_url(state, redirect_uri)
         return redirect(auth_url)
 
-    account_id = (request.form.get("account_id") or "").strip()
+    account_id = _form("account_id")
     airtable_input = (
         (request.form.get("airtable_base_url") or request.form.get("airtable_base_id") or "").strip()
     )
     airtable_base_id = _extract_airtable_base_id(airtable_input)
-    airtable_table_name = (request.form.get("airtable_table_name") or "").strip() or "Items"
+    airtable_table_name = _form("airtable_table_name") or "Items"
     if not account_id or not airtable_base_id:
-        shared_keys = _list_shared_keys()
-        return render_template_string(
-            CONNECT_HTML,
-            shared_keys=shared_keys,
-            error="Please fill in Account ID and paste the link to your Airtable.",
-        )
-    airtable_api_key = (request.form.get("airtable_api_key") or "").strip()
-    shared_key_pending = session.pop("shared_key_pending", None)
+        return _connect_page("Please fill in Account ID and paste the link to your Airtable.")
+    airtable_api_key = _form("airtable_api_key")
+    shared_key_pending = _pop_pending("shared_key_pending")
     if not shared_key_pending and not airtable_api_key:
-        shared_keys = _list_shared_keys()
-        return render_template_string(
-            CONNECT_HTML,
-            shared_keys=shared_keys,
-            error="Provide your Airtable API key: use an existing store key from the dropdown above, or paste your own token in the “Upload your own API key” section.",
+        return _connect_page(
+            "Provide your Airtable API key: use an existing store key from the dropdown above, or paste your own token in the “Upload your own API key” section."
         )
-    client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-    client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
-    if not client_id or not client_secret:
-        shared_keys = _list_shared_keys()
-        return render_template_string(CONNECT_HTML, shared_keys=shared_keys, error="Server missing Lightspeed client credentials.")
+    if not _LS_CLIENT_ID or not _LS_CLIENT_SECRET:
+        return _connect_page("Server missing Lightspeed client credentials.")
     redirect_uri = _oauth_redirect_uri()
     state = secrets.token_urlsafe(24)
-    share_label = (request.form.get("share_label") or "").strip()
+    share_label = _form("share_label")
     share_password = request.form.get("share_password") or ""
+    use_shared_key = bool(shared_key_pending and shared_key_pending.get("shared_key_id"))
+    # Built in one go: every key the callback reads is present, empty when unused
     pending_connect = {
         "state": state,
         "redirect_uri": redirect_uri,
         "account_id": account_id,
         "airtable_base_id": airtable_base_id,
         "airtable_table_name": airtable_table_name,
-        "airtable_api_key": airtable_api_key,
+        "airtable_api_key": "" if use_shared_key else airtable_api_key,  # use shared key after link
+        "shared_key_id": shared_key_pending["shared_key_id"] if use_shared_key else "",
+        "shared_key_password": shared_key_pending.get("shared_key_password", "") if use_shared_key else "",
+        "create_shared_key_after_connect": (
+            {"label": share_label, "password": share_password, "api_key": airtable_api_key}
+            if airtable_api_key and share_label and share_password
+            else None
+        ),
     }
-    if shared_key_pending and shared_key_pending.get("shared_key_id"):
-        pending_connect["shared_key_id"] = shared_key_pending["shared_key_id"]
-        pending_connect["shared_key_password"] = shared_key_pending.get("shared_key_password", "")
-        pending_connect["airtable_api_key"] = ""  # use shared key after link
-    if airtable_api_key and share_label and share_password:
-        pending_connect["create_shared_key_after_connect"] = {
-            "label": share_label,
-            "password": share_password,
-            "api_key": airtable_api_key,
-        }
-    session["pending_connect"] = pending_connect
-    auth_url = (
-        f"{ls.AUTHORIZE_URL}?response_type=code&client_id={quote(client_id, safe='')}"
-        f"&scope=employee:all&state={quote(state, safe='')}&redirect_uri={quote(redirect_uri, safe='')}"
-    )
+    if not _stash_pending("pending_connect", pending_connect):
+        return _connect_page(_PENDING_FULL_ERROR)
+    auth_url = _auth_url(state, redirect_uri)
     return redirect(auth_url)
 
 
+def _extract_code(url: str) -> str | None:
+    """The code= parameter from a pasted redirect URL (or bare query string), decoded like parse_qs."""
+    start = 0
+    while True:
+        i = url.find("code=", start)
+        if i < 0:
+            return None
+        # Skip matches inside another parameter name (e.g. "barcode=")
+        if i == 0 or url[i - 1] in "?&":
+            break
+        start = i + 5
+    end = len(url)
+    for sep in "&#":
+        j = url.find(sep, i + 5)
+        if 0 <= j < end:
+            end = j
+    return unquote_plus(url[i + 5:end]) or None
+
+
+@functools.lru_cache(maxsize=1)
+def _connect_success_path() -> str:
+    return url_for("connect_success")
+
+
+def _connect_success_url(conn_id: str) -> str:
+    """Same URL as url_for("connect_success", key=conn_id); the route is looked up once."""
+    return f"{_connect_success_path()}?key={quote(conn_id, safe='')}"
+
+
+def _finalize_oauth(pending: dict, data: dict) -> str:
+    """Store the tokens from a finished OAuth flow (paste or callback); return the connection id.
+
+    A reconnect updates the existing connection's tokens; otherwise the connection row, shared-key
+    link and any new shared key land in one transaction.
+    """
+    reconnect_id = pending.get("reconnect_connection_id")
+    if reconnect_id:
+        _update_connection_tokens(
+            reconnect_id, data["access_token"], data["refresh_token"], data.get("expires_in")
+        )
+        _pop_pending("pending_connect")
+        return reconnect_id
+    create_after = pending.get("create_shared_key_after_connect")
+    # The scrypt verify/hash runs before BEGIN IMMEDIATE, so other writers never wait behind the KDF
+    link_shared_key_id = None
+    if pending.get("shared_key_id") and pending.get("shared_key_password"):
+        if _verify_shared_key_password(pending["shared_key_id"], pending["shared_key_password"]):
+            link_shared_key_id = pending["shared_key_id"]
+    new_shared_key = None
+    if create_after and create_after.get("label") and create_after.get("password") and create_after.get("api_key"):
+        pwh = generate_password_hash(create_after["password"], method="scrypt")
+        new_shared_key = (create_after["label"], pwh, create_after["api_key"])
+    with _tx():
+        conn_id = _create_connection(
+            access_token=data["access_token"],
+            refresh_token=data["refresh_token"],
+            account_id=pending["account_id"],
+            airtable_api_key=pending.get("airtable_api_key") or "",
+            airtable_base_id=pending["airtable_base_id"],
+            airtable_table_name=pending["airtable_table_name"],
+            expires_in=data.get("expires_in"),
+        )
+        if link_shared_key_id:
+            _link_shared_key(link_shared_key_id, conn_id)
+        if new_shared_key:
+            _link_shared_key(_insert_shared_key(*new_shared_key), conn_id)
+    _pop_pending("pending_connect")
+    return conn_id
+
+
 @app.route("/connect/paste", methods=["GET", "POST"])
 def connect_paste():
-    pending = session.get("pending_connect") or {}
+    pending = _pending("pending_connect")
     if not pending:
         return redirect(url_for("connect_page"))
     if request.method == "GET":
-        client_id = ls.env("LIGHTSPEED_CLIENT_ID")
         redirect_uri = pending.get("redirect_uri", _oauth_redirect_uri())
-        auth_url = (
-            f"{ls.AUTHORIZE_URL}?response_type=code&client_id={quote(client_id, safe='')}"
-            f"&scope=employee:all&state={quote(pending.get('state', ''), safe='')}&redirect_uri={quote(redirect_uri, safe='')}"
-        )
-        return render_template_string(CONNECT_PASTE_HTML, auth_url=auth_url)
-    redirect_url = (request.form.get("redirect_url") or "").strip()
+        auth_url = _auth_url(pending.get("state", ""), redirect_uri)
+        return _CONNECT_PASTE_TMPL.render(auth_url=auth_url)
+    redirect_url = _form("redirect_url")
     if not redirect_url:
-        client_id = ls.env("LIGHTSPEED_CLIENT_ID")
         redirect_uri = pending.get("redirect_uri", _oauth_redirect_uri())
-        auth_url = (
-            f"{ls.AUTHORIZE_URL}?response_type=code&client_id={quote(client_id, safe='')}"
-            f"&scope=employee:all&state={quote(pending.get('state', ''), safe='')}&redirect_uri={quote(redirect_uri, safe='')}"
-        )
-        return render_template_string(
-            CONNECT_PASTE_HTML,
+        auth_url = _auth_url(pending.get("state", ""), redirect_uri)
+        return _CONNECT_PASTE_TMPL.render(
             auth_url=auth_url,
             error="Please paste the full redirect URL.",
         )
-    parsed = urlparse(redirect_url)
-    if not parsed.query and "code=" in redirect_url:
-        redirect_url = "http://dummy?" + redirect_url
-        parsed = urlparse(redirect_url)
-    qs = parse_qs(parsed.query)
-    code = (qs.get("code") or [None])[0]
+    code = _extract_code(redirect_url)
     if not code:
-        session.pop("pending_connect", None)
-        return render_template_string(CONNECT_HTML, shared_keys=_list_shared_keys(), error="No 'code' in URL. Paste the full URL from the address bar after authorizing.")
+        _pop_pending("pending_connect")
+        return _connect_page("No 'code' in URL. Paste the full URL from the address bar after authorizing.")
     redirect_uri = pending.get("redirect_uri") or _oauth_redirect_uri()
-    client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-    client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
     try:
-        data = ls.exchange_code_for_tokens(code, client_id, client_secret, redirect_uri)
+        data = ls.exchange_code_for_tokens(code, _LS_CLIENT_ID, _LS_CLIENT_SECRET, redirect_uri)
     except Exception as e:
-        return render_template_string(CONNECT_HTML, shared_keys=_list_shared_keys(), error=f"Token exchange failed: {e}")
-    reconnect_id = pending.get("reconnect_connection_id")
-    if reconnect_id:
-        _update_connection_tokens(reconnect_id, data["access_token"], data["refresh_token"])
-        session.pop("pending_connect", None)
-        return redirect(url_for("connect_success", key=reconnect_id))
-    conn_id = _create_connection(
-        access_token=data["access_token"],
-        refresh_token=data["refresh_token"],
-        account_id=pending["account_id"],
-        airtable_api_key=pending.get("airtable_api_key") or "",
-        airtable_base_id=pending["airtable_base_id"],
-        airtable_table_name=pending["airtable_table_name"],
-    )
-    if pending.get("shared_key_id") and pending.get("shared_key_password"):
-        _unlock_shared_key(pending["shared_key_id"], pending["shared_key_password"], conn_id)
-    create_after = pending.get("create_shared_key_after_connect")
-    if create_after and create_after.get("label") and create_after.get("password") and create_after.get("api_key"):
-        sk_id = _create_shared_key(create_after["label"], create_after["password"], create_after["api_key"])
-        _unlock_shared_key(sk_id, create_after["password"], conn_id)
-    session.pop("pending_connect", None)
-    return redirect(url_for("connect_success", key=conn_id))
+        return _connect_page(f"Token exchange failed: {e}")
+    conn_id = _finalize_oauth(pending, data)
+    return redirect(_connect_success_url(conn_id))
 
 
 @app.route("/connect/callback")
@@ -1668,42 +2683,17 @@ def connect_callback():
     """Used when BACKEND_PUBLIC_URL is HTTPS (direct redirect from Lightspeed)."""
     state = request.args.get("state") or ""
     code = request.args.get("code") or ""
-    pending = session.get("pending_connect") or {}
+    pending = _pending("pending_connect")
     if not code or pending.get("state") != state:
-        return render_template_string(
-            CONNECT_HTML,
-            shared_keys=_list_shared_keys(),
-            error="Invalid or expired link. Please start again from /connect.",
-        ), 400
+        return _connect_page("Invalid or expired link. Please start again from /connect."), 400
     redirect_uri = _oauth_redirect_uri()
-    client_id = ls.env("LIGHTSPEED_CLIENT_ID")
-    client_secret = ls.env("LIGHTSPEED_CLIENT_SECRET")
     try:
-        data = ls.exchange_code_for_tokens(code, client_id, client_secret, redirect_uri)
+        data = ls.exchange_code_for_tokens(code, _LS_CLIENT_ID, _LS_CLIENT_SECRET, redirect_uri)
     except Exception as e:
-        session.pop("pending_connect", None)
-        return render_template_string(CONNECT_HTML, shared_keys=_list_shared_keys(), error=f"Token exchange failed: {e}"), 200
-    reconnect_id = pending.get("reconnect_connection_id")
-    if reconnect_id:
-        _update_connection_tokens(reconnect_id, data["access_token"], data["refresh_token"])
-        session.pop("pending_connect", None)
-        return redirect(url_for("connect_success", key=reconnect_id))
-    conn_id = _create_connection(
-        access_token=data["access_token"],
-        refresh_token=data["refresh_token"],
-        account_id=pending["account_id"],
-        airtable_api_key=pending.get("airtable_api_key") or "",
-        airtable_base_id=pending["airtable_base_id"],
-        airtable_table_name=pending["airtable_table_name"],
-    )
-    if pending.get("shared_key_id") and pending.get("shared_key_password"):
-        _unlock_shared_key(pending["shared_key_id"], pending["shared_key_password"], conn_id)
-    create_after = pending.get("create_shared_key_after_connect")
-    if create_after and create_after.get("label") and create_after.get("password") and create_after.get("api_key"):
-        sk_id = _create_shared_key(create_after["label"], create_after["password"], create_after["api_key"])
-        _unlock_shared_key(sk_id, create_after["password"], conn_id)
-    session.pop("pending_connect", None)
-    return redirect(url_for("connect_success", key=conn_id))
+        _pop_pending("pending_connect")
+        return _connect_page(f"Token exchange failed: {e}"), 200
+    conn_id = _finalize_oauth(pending, data)
+    return redirect(_connect_success_url(conn_id))
 
 
 @app.route("/connect/success")
@@ -1711,7 +2701,8 @@ def connect_success():
     key = request.args.get("key") or ""
     if not key or not _get_connection(key):
         return "Invalid or expired connection key.", 404
-    return render_template_string(SUCCESS_HTML, connection_key=key)
+    # Shows the connection key: never keep it in a browser or proxy cache
+    return _html_response(_SUCCESS_TMPL.render(connection_key=key), cache_control="no-store, private")
 
 
 # ----- Shared store keys (one person uploads key + password; others unlock with password) -----
@@ -1720,27 +2711,25 @@ def connect_success():
 @app.route("/shared-keys/create", methods=["GET", "POST"])
 def shared_keys_create():
     if request.method == "GET":
-        return render_template_string(SHARED_KEY_CREATE_HTML)
-    label = (request.form.get("label") or "").strip()
+        return _SHARED_KEY_CREATE_TMPL.render()
+    label = _form("label")
     password = request.form.get("password") or ""
-    api_key = (request.form.get("api_key") or "").strip()
+    api_key = _form("api_key")
     if not label or not password or not api_key:
-        return render_template_string(
-            SHARED_KEY_CREATE_HTML,
+        return _SHARED_KEY_CREATE_TMPL.render(
             error="Please fill in screen name, password, and Airtable API key.",
         )
     try:
         _create_shared_key(label, password, api_key)
-        return render_template_string(SHARED_KEY_CREATE_HTML, saved=True)
+        return _SHARED_KEY_CREATE_TMPL.render(saved=True)
     except Exception as e:
-        return render_template_string(SHARED_KEY_CREATE_HTML, error=str(e))
+        return _SHARED_KEY_CREATE_TMPL.render(error=str(e))
 
 
 @app.route("/api/shared-keys", methods=["GET"])
 def api_shared_keys_list():
     """List available shared keys (id and label only)."""
-    keys = _list_shared_keys()
-    return jsonify({"shared_keys": keys})
+    return Response(_shared_keys_json(), mimetype="application/json")
 
 
 @app.route("/api/shared-keys", methods=["POST"])
@@ -1759,10 +2748,20 @@ def api_shared_keys_create():
         return jsonify({"success": False, "error": str(e)}), 200
 
 
+def _json_body() -> dict | None:
+    """The request's JSON object, or None without parsing when there is no JSON body to read."""
+    if not request.is_json or (request.content_length is not None and request.content_length < 2):
+        return None
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+
 @app.route("/api/shared-keys/<shared_key_id>/unlock", methods=["POST"])
 def api_shared_keys_unlock(shared_key_id):
     """Unlock a shared key for a connection (JSON: password, connection_id)."""
-    data = request.get_json() or {}
+    data = _json_body()
+    if data is None:
+        return jsonify({"success": False, "error": "Missing password or connection_id"}), 200
     password = data.get("password") or ""
     connection_id = (data.get("connection_id") or "").strip()
     if not password or not connection_id:
@@ -1777,21 +2776,31 @@ def api_shared_keys_unlock(shared_key_id):
 @app.route("/api/connection-info", methods=["GET"])
 def api_connection_info():
     """Return connection info for the extension (e.g. Airtable base URL). Key in query: key=connection_id."""
-    key = (request.args.get("key") or "").strip()
+    key = _arg("key")
     if not key:
         return jsonify({"error": "Missing key"}), 400
     row = _get_connection(key)
     if not row:
         return jsonify({"error": "Connection not found"}), 404
     base_id = (row["airtable_base_id"] or "").strip()
-    airtable_base_url = f"https://airtable.com/{base_id}" if base_id else ""
-    return jsonify({"connection_id": key, "airtable_base_url": airtable_base_url})
+    # The body only depends on the key and base, so a poll whose ETag still matches gets an empty 304
+    etag = hashlib.blake2b(f"{key}|{base_id}".encode(), digest_size=8).hexdigest()
+    if request.if_none_match.contains(etag):
+        resp = Response(status=304)
+    else:
+        airtable_base_url = f"https://airtable.com/{base_id}" if base_id else ""
+        resp = jsonify({"connection_id": key, "airtable_base_url": airtable_base_url})
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
 
 
 @app.route("/api/connection/update-base", methods=["POST"])
 def api_connection_update_base():
     """Update the Airtable base for a connection. JSON: connection_id, airtable_base_url."""
-    data = request.get_json() or {}
+    data = _json_body()
+    if data is None:
+        return jsonify({"success": False, "error": "Missing connection_id or airtable_base_url"}), 200
     connection_id = (data.get("connection_id") or "").strip()
     airtable_base_url = (data.get("airtable_base_url") or "").strip()
     if not connection_id or not airtable_base_url:
@@ -1810,7 +2819,7 @@ AIRTABLE_META_BASE = "https://api.airtable.com/v0/meta"
 def _airtable_table_name(api_key: str, base_id: str, table_id: str) -> str:
     """Return table name for the given base and table id; falls back to table_id if meta API fails."""
     try:
-        resp = requests.get(
+        resp = ls.HTTP_SESSION.get(
             f"{AIRTABLE_META_BASE}/bases/{quote(base_id)}/tables",
             headers={"Authorization": f"Bearer {api_key}"},
             timeout=10,
@@ -1837,7 +2846,7 @@ def _airtable_fetch_image_urls(api_key: str, base_id: str, table_id: str) -> lis
     params: dict = {}
     attachment_field_name: str | None = None
     while True:
-        resp = requests.get(
+        resp = ls.HTTP_SESSION.get(
             url,
             params=params,
             headers={"Authorization": f"Bearer {api_key}"},
@@ -1886,9 +2895,9 @@ def _airtable_fetch_image_urls(api_key: str, base_id: str, table_id: str) -> lis
 def api_airtable_image_urls():
     """Return list of image URLs from an Airtable table for the extension to download. Query or JSON: connection_id, base_id, table_id."""
     if request.method == "GET":
-        connection_id = (request.args.get("connection_id") or "").strip()
-        base_id = (request.args.get("base_id") or "").strip()
-        table_id = (request.args.get("table_id") or "").strip()
+        connection_id = _arg("connection_id")
+        base_id = _arg("base_id")
+        table_id = _arg("table_id")
     else:
         data = request.get_json() or {}
         connection_id = (data.get("connection_id") or "").strip()
@@ -1911,42 +2920,49 @@ def api_airtable_image_urls():
         return jsonify({"success": False, "error": str(e)}), 200
 
 
+# Hide "Image URL" from the list; it is added automatically when "Image" is selected (for CSV/Canva-friendly links)
+_SETTINGS_FIELDS = [f for f in ls.AVAILABLE_FIELDS if f["id"] != "image_url"]
+_SETTINGS_FIELD_IDS = frozenset(f["id"] for f in _SETTINGS_FIELDS)
+
+
+def _settings_response(**context) -> Response:
+    """The settings page embeds the connection key, so it is never cached."""
+    return _html_response(_SETTINGS_TMPL.render(**context), cache_control="no-store, private")
+
+
 @app.route("/settings", methods=["GET", "POST"])
 def settings_page():
     key = (request.args.get("key") or request.form.get("key") or "").strip()
     if not key:
         return "Missing key. Open /settings?key=YOUR_CONNECTION_KEY", 400
-    if not _get_connection(key):
+    row = _get_connection(key)
+    if not row:
         return "Invalid or expired connection key.", 404
-    # Hide "Image URL" from the list; it is added automatically when "Image" is selected (for CSV/Canva-friendly links)
-    available = [f for f in ls.AVAILABLE_FIELDS if f["id"] != "image_url"]
-    selected_ids = set(_get_selected_fields(key))
+    available = _SETTINGS_FIELDS
+    selected_ids = _selected_field_set(row)
     if request.method == "POST":
         chosen = request.form.getlist("field")
-        valid = {f["id"] for f in available}
-        filtered = [x for x in chosen if x in valid]
+        filtered = [x for x in chosen if x in _SETTINGS_FIELD_IDS]
         if not filtered:
-            return render_template_string(
-                SETTINGS_HTML,
+            return _settings_response(
                 key=key,
                 available_fields=available,
                 selected_ids=selected_ids,
                 error="Select at least one field.",
             )
-        _update_connection_fields(key, filtered)
-        airtable_key_input = (request.form.get("airtable_api_key") or "").strip()
-        if airtable_key_input:
-            _update_connection_airtable_key(key, airtable_key_input)
-        selected_ids = set(filtered)
-        return render_template_string(
-            SETTINGS_HTML,
+        airtable_key_input = _form("airtable_api_key")
+        with _tx():
+            _update_connection_fields(key, filtered)
+            if airtable_key_input:
+                _update_connection_airtable_key(key, airtable_key_input)
+        selected_ids = frozenset(filtered)
+        return _settings_response(
             key=key,
             available_fields=available,
             selected_ids=selected_ids,
             saved=True,
         )
-    return render_template_string(
-        SETTINGS_HTML,
+    return _settings_response(
         key=key,
         available_fields=available,
         selected_ids=selected_ids,
@@ -1956,6 +2972,7 @@ def settings_page():
 def main():
     load_dotenv()
     _init_db()
+    _start_token_refresher()
     port = int(os.environ.get("PORT", 5050))
     # Bind to 0.0.0.0 when PORT is set (e.g. Railway, Render) so the server accepts external requests
     host = "0.0.0.0" if os.environ.get("PORT") else "127.0.0.1"
@@ -1963,7 +2980,17 @@ def main():
     print(f"Backend: {base}", file=sys.stderr)
     print("  GET  /connect = connect your Lightspeed + Airtable (once per user)", file=sys.stderr)
     print("  POST /api/run (connection_id, category_id) = run export (extension)", file=sys.stderr)
-    app.run(host=host, port=port, debug=False, use_reloader=False)
+    print("  GET  /api/run/<job_id> = export status/result", file=sys.stderr)
+    if os.environ.get("PORT"):
+        # Hosted: use waitress when it's installed (production WSGI server, fixed thread pool)
+        try:
+            from waitress import serve
+        except ImportError:
+            serve = None
+        if serve is not None:
+            serve(app, host=host, port=port, threads=int(os.environ.get("WEB_THREADS", 8)))
+            return
+    app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
 
 
 if __name__ == "__main__":
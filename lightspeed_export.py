@@ -8,20 +8,37 @@ from __future__ import annotations
 
 import argparse
 import concurrent.futures
+import contextvars
 import csv
+import functools
 import http.server
+import itertools
 import json
+import operator
 import os
+import random
+import re
 import secrets
+import shutil
 import socketserver
 import sys
+import threading
 import time
 import webbrowser
+from collections import deque
 from pathlib import Path
+from typing import Callable
 from urllib.parse import parse_qs, urlparse, quote
 
 import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is used without it
+    orjson = None
 
 # -----------------------------------------------------------------------------
 # Config
@@ -34,6 +51,15 @@ REFRESH_URL = "https://cloud.lightspeedapp.com/auth/oauth/token"
 LOCAL_CALLBACK_PORT = 8765
 LOCAL_REDIRECT_URI = f"http://127.0.0.1:{LOCAL_CALLBACK_PORT}/callback"
 LIMIT = 100  # API max per request
+CATEGORY_FETCH_WORKERS = 4  # category walks run in parallel when exporting a category tree
+
+
+class _ContextThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """ThreadPoolExecutor whose tasks run in a copy of the submitting thread's context variables, so
+    per-caller state (the export backend's per-job log capture) follows the work onto pool threads."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
 
 
 def _rate_delay_sec() -> float:
@@ -51,6 +77,33 @@ def env(key: str, default: str = "") -> str:
     return os.environ.get(key, default).strip()
 
 
+# Shared pooled session for the OAuth token endpoint and the Airtable API, so the export backend
+# (which runs exports in process) keeps those connections alive across requests. Retries only cover
+# failed connects (a POST isn't replayed once sent), so a single-use code or refresh token is never
+# submitted twice and records are never pushed twice.
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount(
+    "https://",
+    HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=3, backoff_factor=0.2)),
+)
+
+
+def _lightspeed_adapter() -> HTTPAdapter:
+    """Adapter for Lightspeed API sessions: a pool big enough for the parallel lookup, item and
+    category walks, with GETs retried on transient 5xx (429s are paced in fetch_all_paginated)."""
+    return HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=32,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=(500, 502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        ),
+    )
+
+
 def exchange_code_for_tokens(
     code: str,
     client_id: str,
@@ -58,7 +111,7 @@ def exchange_code_for_tokens(
     redirect_uri: str,
 ) -> dict:
     """Exchange an authorization code for access_token and refresh_token."""
-    resp = requests.post(
+    resp = HTTP_SESSION.post(
         TOKEN_URL,
         data={
             "grant_type": "authorization_code",
@@ -91,6 +144,7 @@ def _run_oauth_login_with_local_server(
 ) -> tuple[str, str]:
     """Use a local HTTP server to capture the OAuth callback automatically."""
     captured: dict[str, str | None] = {"code": None}
+    callback_received = threading.Event()
 
     class CallbackHandler(http.server.BaseHTTPRequestHandler):
         def do_GET(self) -> None:
@@ -98,6 +152,7 @@ def _run_oauth_login_with_local_server(
             if parsed.path == "/callback":
                 qs = parse_qs(parsed.query)
                 captured["code"] = (qs.get("code") or [None])[0]
+                callback_received.set()
             self.send_response(200)
             self.send_header("Content-Type", "text/html; charset=utf-8")
             self.end_headers()
@@ -114,7 +169,9 @@ def _run_oauth_login_with_local_server(
         file=sys.stderr,
     )
     with socketserver.TCPServer(("127.0.0.1", LOCAL_CALLBACK_PORT), CallbackHandler) as server:
-        server.timeout = 300  # 5 min to log in
+        # Serve in the background (favicon and other stray requests are just answered) until the
+        # callback arrives or the 5 minutes to log in run out
+        threading.Thread(target=server.serve_forever, name="oauth-callback", daemon=True).start()
         auth_url = (
             f"{AUTHORIZE_URL}?response_type=code&client_id={quote(client_id, safe='')}"
             f"&scope=employee:all&state={quote(state, safe='')}"
@@ -128,8 +185,8 @@ def _run_oauth_login_with_local_server(
         )
         webbrowser.open(auth_url)
         print("Waiting for you to sign in and authorize in the browser...", file=sys.stderr)
-        while captured.get("code") is None:
-            server.handle_request()
+        callback_received.wait(timeout=300)
+        server.shutdown()
 
     code = captured.get("code")
     if not code:
@@ -186,25 +243,32 @@ def run_oauth_login(client_id: str, client_secret: str, redirect_uri: str) -> tu
     return _run_oauth_login_paste_url(client_id, client_secret, redirect_uri, state)
 
 
+_ENV_TOKEN_LINE_RE = re.compile(r"^[ \t]*(LIGHTSPEED_(?:ACCESS|REFRESH)_TOKEN)=.*$", re.M)
+
+
 def update_env_tokens(access_token: str, refresh_token: str) -> None:
-    """Update or append LIGHTSPEED_ACCESS_TOKEN and LIGHTSPEED_REFRESH_TOKEN in .env."""
+    """Update or append LIGHTSPEED_ACCESS_TOKEN and LIGHTSPEED_REFRESH_TOKEN in .env.
+
+    The file is rewritten through a temp file and os.replace, so a crash mid-write can't lose the tokens.
+    """
     env_path = Path.cwd() / ".env"
-    lines: list[str] = []
     updated = {"LIGHTSPEED_ACCESS_TOKEN": access_token, "LIGHTSPEED_REFRESH_TOKEN": refresh_token}
     done = set()
-    if env_path.exists():
-        for line in env_path.read_text(encoding="utf-8").splitlines():
-            for key in updated:
-                if line.strip().startswith(f"{key}="):
-                    lines.append(f"{key}={updated[key]}")
-                    done.add(key)
-                    break
-            else:
-                lines.append(line)
+
+    def replace_line(m: re.Match) -> str:
+        done.add(m.group(1))
+        return f"{m.group(1)}={updated[m.group(1)]}"
+
+    text = env_path.read_text(encoding="utf-8") if env_path.exists() else ""
+    lines = _ENV_TOKEN_LINE_RE.sub(replace_line, text).splitlines()
     for key in updated:
         if key not in done:
             lines.append(f"{key}={updated[key]}")
-    env_path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    tmp = env_path.with_name(".env.tmp")
+    tmp.write_text("\n".join(lines) + "\n", encoding="utf-8")
+    if env_path.exists():
+        shutil.copymode(env_path, tmp)
+    os.replace(tmp, env_path)
     print("Saved access token and refresh token to .env", file=sys.stderr)
 
 
@@ -214,7 +278,7 @@ def refresh_oauth_token(
     client_secret: str,
 ) -> dict:
     """Exchange a refresh token for a new access token (and new refresh token)."""
-    resp = requests.post(
+    resp = HTTP_SESSION.post(
         REFRESH_URL,
         data={
             "grant_type": "refresh_token",
@@ -241,56 +305,114 @@ def refresh_oauth_token(
     return data
 
 
+class LightspeedAuthError(RuntimeError):
+    """The refresh token was rejected; the user has to reconnect."""
+
+
 class SessionWithRefresh:
     """
     Session that uses an access token and refreshes automatically on 401.
     Holds refresh_token, client_id, client_secret; after each refresh, the new
     refresh_token is stored for the next refresh (old one is revoked once used).
+    Once a refresh has reported expires_in, the token is refreshed shortly before it expires instead.
+    Refreshes are serialized, so parallel walks that hit the same expiry refresh once.
+    With a refresher, refreshes go through it instead: it gets the stale access token and returns
+    (access_token, refresh_token, expires_in), e.g. a pair the owner already rotated and stored.
     """
 
+    # Refresh this long before the reported expiry
+    REFRESH_MARGIN_SEC = 60
+
     def __init__(
         self,
         access_token: str,
         refresh_token: str,
         client_id: str,
         client_secret: str,
+        refresher: Callable[[str], tuple[str, str, float | None]] | None = None,
     ) -> None:
         self._session = requests.Session()
         self._session.headers["Accept"] = "application/json"
+        self._session.mount("https://", _lightspeed_adapter())
         self._access_token = access_token
         self._refresh_token = refresh_token
         self._client_id = client_id
         self._client_secret = client_secret
+        self._refresher = refresher
+        self._expires_at: float | None = None  # time.monotonic() deadline, known after a refresh
+        self._refresh_lock = threading.Lock()
         self._update_auth_header()
 
     def _update_auth_header(self) -> None:
         self._session.headers["Authorization"] = f"Bearer {self._access_token}"
 
-    def _refresh(self) -> None:
+    @property
+    def tokens(self) -> tuple[str, str]:
+        """Current (access_token, refresh_token); they change when a 401 triggers a refresh."""
+        return self._access_token, self._refresh_token
+
+    @property
+    def expires_in(self) -> float | None:
+        """Seconds until the current access token expires, once a refresh has reported it; else None."""
+        if self._expires_at is None:
+            return None
+        return max(0.0, self._expires_at + self.REFRESH_MARGIN_SEC - time.monotonic())
+
+    def adopt_tokens(self, latest: Callable[[], tuple[str, str, float | None]]) -> None:
+        """Swap in the owner's latest (access_token, refresh_token, expires_in), e.g. tokens rotated
+        elsewhere, keeping the pooled connections. latest() is read under the refresh lock, so a refresh
+        running on another thread finishes first and is never undone by an older pair."""
+        with self._refresh_lock:
+            access_token, refresh_token, expires_in = latest()
+            if (access_token, refresh_token) != self.tokens:
+                self._set_tokens(access_token, refresh_token, expires_in)
+
+    def _set_tokens(self, access_token: str, refresh_token: str, expires_in) -> None:
+        self._access_token = access_token
+        self._refresh_token = refresh_token
         try:
-            data = refresh_oauth_token(
-                self._refresh_token,
-                self._client_id,
-                self._client_secret,
-            )
-        except requests.exceptions.HTTPError:
-            print(
-                "Lightspeed sign-in has expired or was revoked. Please reconnect: "
-                "open the extension options, click Reconnect, and complete the connection flow again.",
-                file=sys.stderr,
-            )
-            sys.exit(1)
-        self._access_token = data["access_token"]
-        if data.get("refresh_token"):
-            self._refresh_token = data["refresh_token"]
+            self._expires_at = time.monotonic() + float(expires_in) - self.REFRESH_MARGIN_SEC
+        except (TypeError, ValueError):
+            self._expires_at = None
         self._update_auth_header()
+
+    def _refresh(self) -> None:
+        if self._refresher is not None:
+            access_token, refresh_token, expires_in = self._refresher(self._access_token)
+        else:
+            try:
+                data = refresh_oauth_token(
+                    self._refresh_token,
+                    self._client_id,
+                    self._client_secret,
+                )
+            except requests.exceptions.HTTPError:
+                raise LightspeedAuthError(
+                    "Lightspeed sign-in has expired or was revoked. Please reconnect: "
+                    "open the extension options, click Reconnect, and complete the connection flow again."
+                ) from None
+            access_token = data["access_token"]
+            refresh_token = data.get("refresh_token") or self._refresh_token
+            expires_in = data.get("expires_in")
+        self._set_tokens(access_token, refresh_token, expires_in)
         print("  Refreshed Lightspeed access token.", file=sys.stderr)
 
+    def _refresh_unless_rotated(self, stale_token: str) -> None:
+        """Refresh, unless another thread already replaced stale_token while we waited for the lock
+        (the old refresh token is revoked by then, so a second refresh would fail)."""
+        with self._refresh_lock:
+            if self._access_token == stale_token:
+                self._refresh()
+
     def get(self, url: str, params: dict | None = None) -> requests.Response:
         params = params or {}
+        token = self._access_token
+        if self._expires_at is not None and time.monotonic() >= self._expires_at:
+            self._refresh_unless_rotated(token)
+            token = self._access_token
         resp = self._session.get(url, params=params)
         if resp.status_code == 401:
-            self._refresh()
+            self._refresh_unless_rotated(token)
             resp = self._session.get(url, params=params)
         return resp
 
@@ -298,41 +420,75 @@ class SessionWithRefresh:
 def get_session(access_token: str) -> requests.Session:
     """Plain session with no refresh (for when refresh credentials are not provided)."""
     s = requests.Session()
+    s.mount("https://", _lightspeed_adapter())
     s.headers["Authorization"] = f"Bearer {access_token}"
     s.headers["Accept"] = "application/json"
     return s
 
 
+def _response_json(resp: requests.Response):
+    """Decode a response body, with orjson when it is installed (item pages are large and nested)."""
+    if orjson is not None:
+        return orjson.loads(resp.content)
+    return resp.json()
+
+
 def get_next_url(data: dict) -> str:
     attrs = data.get("@attributes") or data.get("attributes") or {}
     return (attrs.get("next") or "").strip()
 
 
+LIGHTSPEED_429_RETRIES = 5
+
+
+def _get_with_backoff(
+    session: requests.Session | SessionWithRefresh, url: str, params: dict
+) -> requests.Response:
+    """GET that waits out Lightspeed 429s (Retry-After if given, else exponential backoff with jitter)."""
+    for attempt in range(LIGHTSPEED_429_RETRIES):
+        resp = session.get(url, params=params)
+        if resp.status_code != 429:
+            return resp
+        try:
+            wait = float(resp.headers.get("Retry-After") or "")
+        except ValueError:
+            wait = 0.5 * 2 ** attempt + random.uniform(0, 0.5)
+        print(f"  Lightspeed rate limit; waiting {wait:.1f}s...", file=sys.stderr)
+        time.sleep(wait)
+    return session.get(url, params=params)
+
+
 def fetch_all_paginated(
     session: requests.Session | SessionWithRefresh,
     account_id: str,
     resource: str,
-    load_relations: list[str] | None = None,
+    load_relations: list[str] | str | None = None,
     sort: str | None = None,
     extra_params: dict | None = None,
 ) -> list[dict]:
-    """Fetch all records for a resource using cursor-based pagination."""
+    """Fetch all records for a resource using cursor-based pagination.
+    load_relations may be passed already JSON-encoded, so callers running many walks encode it once.
+    """
     url = f"{BASE_URL}/{account_id}/{resource}.json"
     sort_field = sort or ("itemID" if resource == "Item" else "vendorID")
     params = {"limit": LIMIT, "sort": sort_field}
     if load_relations:
-        params["load_relations"] = json.dumps(load_relations)
+        params["load_relations"] = (
+            load_relations if isinstance(load_relations, str) else json.dumps(load_relations)
+        )
     if extra_params:
         params.update(extra_params)
 
     all_records: list[dict] = []
     page = 0
+    delay = _rate_delay_sec()
 
     while True:
         page += 1
-        resp = session.get(url, params=params)
+        sent = time.monotonic()
+        resp = _get_with_backoff(session, url, params)
         resp.raise_for_status()
-        data = resp.json()
+        data = _response_json(resp)
 
         # Normalize: API returns either {"Item": {...}} (single) or {"Item": [...]}
         key = resource  # e.g. "Item" or "Vendor"
@@ -349,49 +505,112 @@ def fetch_all_paginated(
         url = next_url
         params = {}  # next URL has everything
 
-        time.sleep(_rate_delay_sec())
+        # The delay is a minimum spacing between requests, so page round-trips count towards it
+        wait = delay - (time.monotonic() - sent)
+        if wait > 0:
+            time.sleep(wait)
         if page % 50 == 0:
             print(f"  ... fetched {len(all_records)} {resource} records so far", file=sys.stderr)
 
     return all_records
 
 
+# Vendor/category/manufacturer/department lists change rarely, so for CLI runs their maps are kept on
+# disk per account for LOOKUP_CACHE_TTL_SEC and repeated exports skip those paginated walks.
+# --refresh-cache (or LOOKUP_CACHE_TTL_SEC=0) forces a refetch. Off unless the CLI turns it on: the
+# backend's exports and galleries always fetch, so renamed vendors/categories show up immediately.
+LOOKUP_CACHE_DIR = Path(env("LOOKUP_CACHE_DIR") or Path.home() / ".cache" / "lightspeed_export")
+use_lookup_cache = False
+refresh_lookup_cache = False
+
+
+def _lookup_cache_ttl_sec() -> float:
+    try:
+        return float(env("LOOKUP_CACHE_TTL_SEC", "3600"))
+    except ValueError:
+        return 3600.0
+
+
+def _disk_cached_lookup(fn):
+    """Cache a build_*_map(session, account_id) result as JSON under LOOKUP_CACHE_DIR.
+
+    Empty maps aren't stored, so a failed or unavailable lookup is retried on the next run.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(session, account_id: str):
+        if not use_lookup_cache:
+            return fn(session, account_id)
+        ttl = _lookup_cache_ttl_sec()
+        path = LOOKUP_CACHE_DIR / f"{account_id}.{fn.__name__}.json"
+        if ttl > 0 and not refresh_lookup_cache:
+            try:
+                if time.time() - path.stat().st_mtime < ttl:
+                    return orjson.loads(path.read_bytes()) if orjson is not None else json.loads(path.read_text())
+            except (OSError, ValueError):
+                pass
+        result = fn(session, account_id)
+        if ttl > 0 and result:
+            try:
+                LOOKUP_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                tmp.write_text(json.dumps(result, ensure_ascii=False), encoding="utf-8")
+                os.replace(tmp, path)
+            except OSError:
+                pass  # caching is best effort
+        return result
+
+    return wrapper
+
+
+def build_id_name_map(
+    session: requests.Session | SessionWithRefresh, account_id: str, resource: str, id_field: str
+) -> dict[str, str]:
+    """Fetch every record of resource and return id_field -> name."""
+    records = fetch_all_paginated(session, account_id, resource, sort=id_field)
+    return {str(r.get(id_field, "")): (r.get("name") or "").strip() for r in records}
+
+
+@_disk_cached_lookup
 def build_vendor_map(
     session: requests.Session | SessionWithRefresh, account_id: str
 ) -> dict[str, str]:
     """Fetch all vendors and return mapping vendorID -> name."""
-    vendors = fetch_all_paginated(session, account_id, "Vendor", sort="vendorID")
-    return {str(v.get("vendorID", "")): (v.get("name") or "").strip() for v in vendors}
+    return build_id_name_map(session, account_id, "Vendor", "vendorID")
 
 
-def get_default_price(item: dict) -> str:
-    """Extract default retail price from Item.Prices.ItemPrice (useType 'Default')."""
+def _item_prices(item: dict) -> tuple[str, str]:
+    """(default retail price, MSRP) from Item.Prices.ItemPrice in one pass over the price list.
+    Default is the useType 'Default' amount, falling back to the first price; MSRP is useType 'MSRP'."""
     prices = item.get("Prices") or {}
     item_prices = prices.get("ItemPrice")
     if not item_prices:
-        return ""
+        return "", ""
     if isinstance(item_prices, dict):
         item_prices = [item_prices]
+    default = msrp = None
     for p in item_prices:
-        if (p.get("useType") or "").strip() == "Default":
-            return (p.get("amount") or "").strip()
-    return (item_prices[0].get("amount") or "").strip() if item_prices else ""
+        use_type = (p.get("useType") or "").strip()
+        if use_type == "Default" and default is None:
+            default = (p.get("amount") or "").strip()
+        elif use_type == "MSRP" and msrp is None:
+            msrp = (p.get("amount") or "").strip()
+    if default is None:
+        default = (item_prices[0].get("amount") or "").strip()
+    return default, msrp or ""
+
+
+def get_default_price(item: dict) -> str:
+    """Extract default retail price from Item.Prices.ItemPrice (useType 'Default')."""
+    return _item_prices(item)[0]
 
 
 def get_msrp(item: dict) -> str:
     """Extract MSRP from Item.Prices.ItemPrice (useType 'MSRP')."""
-    prices = item.get("Prices") or {}
-    item_prices = prices.get("ItemPrice")
-    if not item_prices:
-        return ""
-    if isinstance(item_prices, dict):
-        item_prices = [item_prices]
-    for p in item_prices:
-        if (p.get("useType") or "").strip() == "MSRP":
-            return (p.get("amount") or "").strip()
-    return ""
+    return _item_prices(item)[1]
 
 
+@_disk_cached_lookup
 def build_category_path_map(
     session: requests.Session | SessionWithRefresh, account_id: str
 ) -> dict[str, list[str]]:
@@ -424,28 +643,24 @@ def get_category_id_and_descendants(
     return out
 
 
+@_disk_cached_lookup
 def build_manufacturer_map(
     session: requests.Session | SessionWithRefresh, account_id: str
 ) -> dict[str, str]:
     """Fetch manufacturers and return manufacturerID -> name (Brand)."""
     try:
-        manufacturers = fetch_all_paginated(
-            session, account_id, "Manufacturer", sort="manufacturerID"
-        )
-        return {str(m.get("manufacturerID", "")): (m.get("name") or "").strip() for m in manufacturers}
+        return build_id_name_map(session, account_id, "Manufacturer", "manufacturerID")
     except Exception:
         return {}
 
 
+@_disk_cached_lookup
 def build_department_map(
     session: requests.Session | SessionWithRefresh, account_id: str
 ) -> dict[str, str]:
     """Fetch departments and return departmentID -> name. Not available on all accounts."""
     try:
-        departments = fetch_all_paginated(
-            session, account_id, "Department", sort="departmentID"
-        )
-        return {str(d.get("departmentID", "")): (d.get("name") or "").strip() for d in departments}
+        return build_id_name_map(session, account_id, "Department", "departmentID")
     except Exception:
         return {}
 
@@ -551,6 +766,9 @@ def get_image_urls(item: dict) -> list[str]:
     return urls
 
 
+_CATEGORY_COLUMNS = ("category",) + tuple(f"subcategory_{i}" for i in range(1, 10))
+
+
 def item_to_row(
     item: dict,
     vendor_map: dict[str, str],
@@ -564,23 +782,24 @@ def item_to_row(
     vendor_id = str(item.get("defaultVendorID") or "")
     vendor_name = (vendor_map or {}).get(vendor_id, "")
     cat_id = str(item.get("categoryID") or "")
-    path_parts = (category_path_map or {}).get(cat_id, [])
     # Category = first level, Subcategory 1..9 = next levels
-    category = path_parts[0] if len(path_parts) >= 1 else ""
-    subcategories = path_parts[1:10]  # up to 9 subcategories
-    while len(subcategories) < 9:
-        subcategories.append("")
+    levels = (category_path_map or {}).get(cat_id, [])[:10]
+    levels += [""] * (10 - len(levels))
 
     manufacturer_id = str(item.get("manufacturerID") or "")
     department_id = str(item.get("departmentID") or "")
     ecom = get_item_ecommerce(item)
+    if not isinstance(ecom, dict):
+        ecom = {}
+    price, msrp = _item_prices(item)
+    model_year = item.get("modelYear")
 
     row = {
         "itemID": str(item_id),
         "name": (item.get("description") or "").strip(),
         "cost": (item.get("defaultCost") or "").strip(),
-        "price": get_default_price(item),
-        "msrp": get_msrp(item),
+        "price": price,
+        "msrp": msrp,
         "vendor_id": vendor_id,
         "vendor_name": vendor_name,
         "systemSku": (item.get("systemSku") or "").strip(),
@@ -588,27 +807,18 @@ def item_to_row(
         "upc": (item.get("upc") or "").strip(),
         "ean": (item.get("ean") or "").strip(),
         "manufacturerSku": (item.get("manufacturerSku") or "").strip(),
-        "year": (item.get("modelYear") or "").strip() if item.get("modelYear") not in (None, "", "0") else "",
+        "year": (model_year or "").strip() if model_year not in (None, "", "0") else "",
         "tax": "Yes" if item.get("tax") in (True, "true", "1") else "No",
         "brand": (manufacturer_map or {}).get(manufacturer_id, ""),
         "department": (department_map or {}).get(department_id, ""),
         "averageCost": get_average_cost(item),
         "note": get_item_note(item),
-        "category": category,
-        "subcategory_1": subcategories[0],
-        "subcategory_2": subcategories[1],
-        "subcategory_3": subcategories[2],
-        "subcategory_4": subcategories[3],
-        "subcategory_5": subcategories[4],
-        "subcategory_6": subcategories[5],
-        "subcategory_7": subcategories[6],
-        "subcategory_8": subcategories[7],
-        "subcategory_9": subcategories[8],
-        "weight": (ecom.get("weight") or "").strip() if isinstance(ecom, dict) else "",
-        "length": (ecom.get("length") or "").strip() if isinstance(ecom, dict) else "",
-        "width": (ecom.get("width") or "").strip() if isinstance(ecom, dict) else "",
-        "height": (ecom.get("height") or "").strip() if isinstance(ecom, dict) else "",
     }
+    row.update(zip(_CATEGORY_COLUMNS, levels))
+    row["weight"] = (ecom.get("weight") or "").strip()
+    row["length"] = (ecom.get("length") or "").strip()
+    row["width"] = (ecom.get("width") or "").strip()
+    row["height"] = (ecom.get("height") or "").strip()
     if include_images:
         urls = get_image_urls(item)
         row["image_urls"] = " | ".join(urls) if urls else ""
@@ -617,23 +827,134 @@ def item_to_row(
     return row
 
 
+def _category_level(item: dict, category_path_map: dict[str, list[str]], level: int) -> str:
+    parts = category_path_map.get(str(item.get("categoryID") or ""), ())
+    return parts[level] if level < len(parts) else ""
+
+
+def _ecom_dimension(item: dict, key: str) -> str:
+    ecom = get_item_ecommerce(item)
+    return (ecom.get(key) or "").strip() if isinstance(ecom, dict) else ""
+
+
+def _stripped(key: str):
+    return lambda item, maps: (item.get(key) or "").strip()
+
+
+# Row key -> extractor(item, (vendor_map, category_path_map, manufacturer_map, department_map)),
+# giving the same value item_to_row puts under that key. Used to build rows holding only selected columns.
+_COLUMN_EXTRACTORS = {
+    "itemID": lambda item, maps: str(item.get("itemID", "")),
+    "name": _stripped("description"),
+    "cost": _stripped("defaultCost"),
+    "price": lambda item, maps: _item_prices(item)[0],
+    "msrp": lambda item, maps: _item_prices(item)[1],
+    "vendor_id": lambda item, maps: str(item.get("defaultVendorID") or ""),
+    "vendor_name": lambda item, maps: maps[0].get(str(item.get("defaultVendorID") or ""), ""),
+    "systemSku": _stripped("systemSku"),
+    "customSku": _stripped("customSku"),
+    "upc": _stripped("upc"),
+    "ean": _stripped("ean"),
+    "manufacturerSku": _stripped("manufacturerSku"),
+    "year": lambda item, maps: (
+        (item.get("modelYear") or "").strip() if item.get("modelYear") not in (None, "", "0") else ""
+    ),
+    "tax": lambda item, maps: "Yes" if item.get("tax") in (True, "true", "1") else "No",
+    "brand": lambda item, maps: maps[2].get(str(item.get("manufacturerID") or ""), ""),
+    "department": lambda item, maps: maps[3].get(str(item.get("departmentID") or ""), ""),
+    "averageCost": lambda item, maps: get_average_cost(item),
+    "note": lambda item, maps: get_item_note(item),
+    **{
+        col: (lambda item, maps, level=level: _category_level(item, maps[1], level))
+        for level, col in enumerate(_CATEGORY_COLUMNS)
+    },
+    **{
+        dim: (lambda item, maps, dim=dim: _ecom_dimension(item, dim))
+        for dim in ("weight", "length", "width", "height")
+    },
+}
+
+
+def selected_row_builder(
+    field_ids: list[str],
+    include_images: bool,
+    vendor_map: dict[str, str] | None = None,
+    category_path_map: dict[str, list[str]] | None = None,
+    manufacturer_map: dict[str, str] | None = None,
+    department_map: dict[str, str] | None = None,
+):
+    """Return item -> row computing only the columns for field_ids (plus the image columns when
+    include_images), instead of all ~30 that item_to_row fills in. Values match item_to_row's."""
+    maps = (vendor_map or {}, category_path_map or {}, manufacturer_map or {}, department_map or {})
+    extractors = [
+        (f["rowKey"], _COLUMN_EXTRACTORS[f["rowKey"]])
+        for f in _fields_for_ids(field_ids)
+        if f["rowKey"] in _COLUMN_EXTRACTORS
+    ]
+
+    def build(item: dict) -> dict:
+        row = {key: extract(item, maps) for key, extract in extractors}
+        if include_images:
+            urls = get_image_urls(item)
+            row["image_urls"] = " | ".join(urls) if urls else ""
+            row["image_url"] = urls[0] if urls else ""
+            row["image_count"] = len(urls)
+        return row
+
+    return build
+
+
+# Category names rarely change; keyed by (account_id, category_id) since sessions aren't hashable.
+# Shared by every export in a long-running process (the backend runs many, mostly the same categories).
+CATEGORY_NAME_CACHE_TTL_SEC = 3600
+_CATEGORY_NAME_CACHE_MAX = 2048
+_category_names: dict[tuple[str, str], tuple[float, str]] = {}
+_category_names_lock = threading.Lock()
+
+
 def get_category_name(
     session: requests.Session | SessionWithRefresh,
     account_id: str,
     category_id: str,
 ) -> str:
-    """Return display name for a category (fullPathName or name)."""
-    categories = fetch_all_paginated(session, account_id, "Category", sort="categoryID")
-    for c in categories:
-        if str(c.get("categoryID", "")) == str(category_id):
-            return (c.get("fullPathName") or c.get("name") or "").strip() or f"Category {category_id}"
-    return f"Category {category_id}"
+    """Return display name for a category (fullPathName or name), cached per account and category."""
+    key = (str(account_id), str(category_id))
+    now = time.monotonic()
+    with _category_names_lock:
+        hit = _category_names.get(key)
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    name = _fetch_category_name(session, account_id, category_id)
+    if name != f"Category {category_id}":  # don't keep the not-found fallback
+        with _category_names_lock:
+            if len(_category_names) >= _CATEGORY_NAME_CACHE_MAX:
+                _category_names.clear()
+            _category_names[key] = (now + CATEGORY_NAME_CACHE_TTL_SEC, name)
+    return name
+
+
+def _fetch_category_name(
+    session: requests.Session | SessionWithRefresh,
+    account_id: str,
+    category_id: str,
+) -> str:
+    """Read just that category from Lightspeed."""
+    url = f"{BASE_URL}/{account_id}/Category/{quote(str(category_id), safe='')}.json"
+    resp = _get_with_backoff(session, url, {})
+    if resp.status_code == 404:
+        return f"Category {category_id}"
+    resp.raise_for_status()
+    c = _response_json(resp).get("Category") or {}
+    if isinstance(c, list):
+        c = c[0] if c else {}
+    return (c.get("fullPathName") or c.get("name") or "").strip() or f"Category {category_id}"
 
 
 def _relations_for_field_ids(field_ids: list[str]) -> list[str]:
-    """Return which Item relations we need to load for the selected fields."""
+    """Return which Item relations we need to load for the selected fields (nothing for fields that
+    come from the Item itself or from the lookup maps)."""
     rels: list[str] = []
-    if "image" in field_ids:
+    if "image" in field_ids or "image_url" in field_ids:
         rels.append("Images")
     if "averageCost" in field_ids:
         rels.append("ItemShops")
@@ -750,9 +1071,12 @@ def export_items(
     field_ids: list[str] | None = None,
     qoh_positive_only: bool = False,
     listing_filters: dict | None = None,
+    selected_columns_only: bool = False,
 ) -> list[dict]:
     """Fetch all items and vendors, return list of Airtable-ready rows.
     When field_ids is set, only fetches relations and lookup data needed for those fields.
+    When selected_columns_only is set, rows hold just those fields' columns (plus image columns) rather
+    than every column; for callers that push or render the selection instead of writing full files.
     When listing_filters is set (or EXPORT_LISTING_FILTERS env), applies UI filters: archived, brand/vendor, shop, qoh, item_type, serialized.
     qoh_positive_only is legacy; prefer listing_filters with qoh_positive/qoh_zero.
     """
@@ -780,8 +1104,43 @@ def export_items(
     need_department = "department" in ids
     need_category_for_filter = bool(category_id)
 
+    relations = list(load_relations or [])
+    for rel in needed_relations:
+        if rel not in relations:
+            relations.append(rel)
+    # Encoded once for all the item walks (one per category when filtering by a category tree)
+    relations_json = json.dumps(relations) if relations else None
+
+    def fetch_items_for_params(extra_params: dict | None) -> list[dict]:
+        try:
+            return fetch_all_paginated(
+                session,
+                account_id,
+                "Item",
+                load_relations=relations_json,
+                sort="itemID",
+                extra_params=extra_params,
+            )
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code == 400:
+                print(
+                    "  API returned 400 with full relations; retrying with Images only (some fields may be empty).",
+                    file=sys.stderr,
+                )
+                return fetch_all_paginated(
+                    session,
+                    account_id,
+                    "Item",
+                    load_relations=["Images"],
+                    sort="itemID",
+                    extra_params=extra_params,
+                )
+            raise
+
+    api_extra = _api_extra_from_listing_filters(filters)
     tasks = []
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+    items_future = None
+    with _ContextThreadPoolExecutor(max_workers=5) as executor:
         if need_vendor:
             tasks.append(("vendor", executor.submit(build_vendor_map, session, account_id)))
         if need_category or need_category_for_filter:
@@ -790,6 +1149,10 @@ def export_items(
             tasks.append(("manufacturer", executor.submit(build_manufacturer_map, session, account_id)))
         if need_department:
             tasks.append(("department", executor.submit(build_department_map, session, account_id)))
+        # Without a category filter the item walk needs no lookup data, so it runs alongside the lookups
+        if not category_id:
+            print("Fetching items (paginated)...", file=sys.stderr)
+            items_future = executor.submit(fetch_items_for_params, api_extra if api_extra else None)
 
     vendor_map: dict[str, str] = {}
     category_path_map: dict[str, list[str]] = {}
@@ -817,38 +1180,6 @@ def export_items(
             parts.append(f"{len(department_map)} departments")
         print(f"  Loaded {', '.join(parts)} (for selected fields).", file=sys.stderr)
 
-    relations = list(load_relations or [])
-    for rel in needed_relations:
-        if rel not in relations:
-            relations.append(rel)
-
-    def fetch_items_for_params(extra_params: dict | None) -> list[dict]:
-        try:
-            return fetch_all_paginated(
-                session,
-                account_id,
-                "Item",
-                load_relations=relations,
-                sort="itemID",
-                extra_params=extra_params,
-            )
-        except requests.exceptions.HTTPError as e:
-            if e.response is not None and e.response.status_code == 400:
-                print(
-                    "  API returned 400 with full relations; retrying with Images only (some fields may be empty).",
-                    file=sys.stderr,
-                )
-                return fetch_all_paginated(
-                    session,
-                    account_id,
-                    "Item",
-                    load_relations=["Images"],
-                    sort="itemID",
-                    extra_params=extra_params,
-                )
-            raise
-
-    api_extra = _api_extra_from_listing_filters(filters)
     if category_id:
         descendant_ids = get_category_id_and_descendants(category_path_map, category_id)
         print(
@@ -858,17 +1189,25 @@ def export_items(
         print("Fetching items (paginated)...", file=sys.stderr)
         seen_item_ids: set[str] = set()
         items = []
-        for cid in descendant_ids:
-            params = _api_extra_from_listing_filters(filters, {"categoryID": cid})
-            batch = fetch_items_for_params(params)
+        # Each category is its own cursor walk, so they can run side by side; map() keeps the order
+        with _ContextThreadPoolExecutor(max_workers=CATEGORY_FETCH_WORKERS) as executor:
+            batches = list(
+                executor.map(
+                    lambda cid: fetch_items_for_params(
+                        _api_extra_from_listing_filters(filters, {"categoryID": cid})
+                    ),
+                    descendant_ids,
+                )
+            )
+        for batch in batches:
             for item in batch:
                 iid = str(item.get("itemID", ""))
                 if iid and iid not in seen_item_ids:
                     seen_item_ids.add(iid)
                     items.append(item)
+        del batches  # items holds the only references now, so converted items can be freed below
     else:
-        print("Fetching items (paginated)...", file=sys.stderr)
-        items = fetch_items_for_params(api_extra if api_extra else None)
+        items = items_future.result()
     print(f"  Loaded {len(items)} items.", file=sys.stderr)
 
     if filters:
@@ -877,17 +1216,27 @@ def export_items(
         if len(items) != before:
             print(f"  Applied listing filters: {len(items)} items (from {before}).", file=sys.stderr)
 
-    rows = [
-        item_to_row(
-            item,
-            vendor_map,
-            include_images=include_images or "Images" in relations,
-            category_path_map=category_path_map,
-            manufacturer_map=manufacturer_map,
-            department_map=department_map,
+    # Raw items (with their loaded relations) are much bigger than rows, so each one is dropped as
+    # soon as it is converted: peak memory is about one copy of the catalog rather than both.
+    include_image_cols = include_images or "Images" in relations
+    if selected_columns_only:
+        to_row = selected_row_builder(
+            ids, include_image_cols, vendor_map, category_path_map, manufacturer_map, department_map
         )
-        for item in items
-    ]
+    else:
+        def to_row(item: dict) -> dict:
+            return item_to_row(
+                item,
+                vendor_map,
+                include_images=include_image_cols,
+                category_path_map=category_path_map,
+                manufacturer_map=manufacturer_map,
+                department_map=department_map,
+            )
+    rows = []
+    for i, item in enumerate(items):
+        rows.append(to_row(item))
+        items[i] = None
     return rows
 
 
@@ -898,6 +1247,9 @@ def write_json(path: Path, rows: list[dict], airtable_style: bool) -> None:
         payload = {"records": records}
     else:
         payload = rows
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+        return
     with open(path, "w", encoding="utf-8") as f:
         json.dump(payload, f, indent=2, ensure_ascii=False)
 
@@ -905,10 +1257,14 @@ def write_json(path: Path, rows: list[dict], airtable_style: bool) -> None:
 def write_csv(path: Path, rows: list[dict]) -> None:
     if not rows:
         return
-    with open(path, "w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=rows[0].keys())
-        w.writeheader()
-        w.writerows(rows)
+    fields = list(rows[0].keys())
+    # Every row comes from item_to_row with the same (30+) keys, so columns are pulled with one C-level
+    # itemgetter per row instead of DictWriter's per-row key checks; a 1 MiB buffer batches the writes.
+    get_columns = operator.itemgetter(*fields)
+    with open(path, "w", encoding="utf-8", newline="", buffering=1 << 20) as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        w.writerows(map(get_columns, rows))
 
 
 def _to_number(s: str) -> float | None:
@@ -974,91 +1330,166 @@ def _field_ids_from_env() -> list[str]:
     return filtered if filtered else DEFAULT_FIELD_IDS
 
 
+_FIELDS_BY_ID = {f["id"]: f for f in AVAILABLE_FIELDS}
+
+
 def _fields_for_ids(ids: list[str]) -> list[dict]:
     """Return AVAILABLE_FIELDS entries for given ids, preserving order. When 'image' is selected, 'image_url' is included so CSV export has a direct link for Canva etc."""
-    by_id = {f["id"]: f for f in AVAILABLE_FIELDS}
-    out = [by_id[i] for i in ids if i in by_id]
+    return list(_fields_spec(tuple(ids)))
+
+
+@functools.lru_cache(maxsize=64)
+def _fields_spec(ids: tuple[str, ...]) -> tuple[dict, ...]:
+    """_fields_for_ids, resolved once per selection (row_to_airtable_fields runs it for every row)."""
+    out = [_FIELDS_BY_ID[i] for i in ids if i in _FIELDS_BY_ID]
     if "image" in ids and "image_url" not in ids:
-        out.append(by_id["image_url"])
-    return out
+        out.append(_FIELDS_BY_ID["image_url"])
+    return tuple(out)
+
+
+def _emit_number(val):
+    return _to_number(str(val or ""))
+
+
+def _emit_attachments(val):
+    urls = [u.strip() for u in (str(val or "").split("|")) if u.strip()]
+    return [{"url": u} for u in urls] if urls else None
+
+
+def _emit_text(val):
+    return str(val or "").strip() or None
+
+
+def _emit_text_always(val):
+    # Image URL is always sent when in spec so the column is populated for CSV/Canva (empty string if no image)
+    return str(val or "").strip()
+
+
+@functools.lru_cache(maxsize=64)
+def _compiled_fields_spec(ids: tuple[str, ...]) -> tuple[tuple[str, str, Callable[[object], object]], ...]:
+    """(displayName, rowKey, emit) per field, with the per-type conversion chosen once per selection.
+    emit returns the Airtable value, or None to leave the field out."""
+    compiled = []
+    for f in _fields_spec(ids):
+        if f["type"] == "number":
+            emit = _emit_number
+        elif f["type"] == "multipleAttachments":
+            emit = _emit_attachments
+        elif f["rowKey"] == "image_url":
+            emit = _emit_text_always
+        else:
+            emit = _emit_text
+        compiled.append((f["displayName"], f["rowKey"], emit))
+    return tuple(compiled)
 
 
 def row_to_airtable_fields(row: dict, field_ids: list[str] | None = None) -> dict:
     """Build Airtable fields dict. Uses field_ids or AIRTABLE_FIELDS env; defaults to Name, Cost, Price, Vendor Name, Image. Image URL (for CSV/Canva) is always sent when Image is selected."""
     ids = field_ids or _field_ids_from_env()
-    fields_spec = _fields_for_ids(ids)
     out: dict = {}
-    for f in fields_spec:
-        key = f["rowKey"]
-        val = row.get(key)
-        if f["type"] == "number":
-            num = _to_number(str(val or "")) if val is not None else _to_number(str(row.get(key) or ""))
-            if num is not None:
-                out[f["displayName"]] = num
-            continue
-        if f["type"] == "multipleAttachments":
-            urls = [u.strip() for u in (str(val or "").split("|")) if u.strip()]
-            if urls:
-                out[f["displayName"]] = [{"url": u} for u in urls]
-            continue
-        # singleLineText (including Image URL)
-        text_val = (str(val or "").strip()) if val is not None else ""
-        if key == "image_url":
-            # Always send Image URL when in spec so the column is populated for CSV/Canva (empty string if no image)
-            out[f["displayName"]] = text_val
-        elif text_val:
-            out[f["displayName"]] = text_val
-    # Ensure Image URL column is always sent when Image is selected (for CSV/Canva)
-    if "image" in ids and "Image URL" not in out:
-        out["Image URL"] = (str(row.get("image_url") or "")).strip()
+    # When Image is selected the spec includes Image URL, so that column is always sent
+    for name, key, emit in _compiled_fields_spec(tuple(ids)):
+        val = emit(row.get(key))
+        if val is not None:
+            out[name] = val
     return out
 
 
-def _build_table_schema(field_ids: list[str] | None = None) -> list[dict]:
+def _build_table_schema(field_ids: list[str] | tuple[str, ...] | None = None) -> list[dict]:
     """Build Airtable table fields schema for create API. Always includes Image URL when Image is selected (for CSV/Canva)."""
-    ids = field_ids or _field_ids_from_env()
-    fields_spec = _fields_for_ids(ids)
+    return list(_table_schema(tuple(field_ids or _field_ids_from_env())))
+
+
+@functools.lru_cache(maxsize=8)
+def _table_schema(ids: tuple[str, ...]) -> tuple[dict, ...]:
+    """_build_table_schema, resolved once per selection from the same cached spec the push uses."""
     schema: list[dict] = []
-    seen_image_url = False
-    for f in fields_spec:
-        if f["id"] == "image_url":
-            seen_image_url = True
+    for f in _fields_spec(ids):
         if f["type"] == "number":
             schema.append({"name": f["displayName"], "type": "number", "options": {"precision": 0}})
         elif f["type"] == "multipleAttachments":
             schema.append({"name": f["displayName"], "type": "multipleAttachments"})
         else:
             schema.append({"name": f["displayName"], "type": "singleLineText"})
-    if "image" in ids and not seen_image_url:
-        schema.append({"name": "Image URL", "type": "singleLineText"})
-    return schema
+    return tuple(schema)
 
 
 AIRTABLE_API_BASE = "https://api.airtable.com/v0"
 AIRTABLE_META_BASE = "https://api.airtable.com/v0/meta"
 AIRTABLE_BATCH_SIZE = 10  # max records per create request
+# Wait after a 429 when Airtable sends no Retry-After (its documented cool-down)
+AIRTABLE_429_WAIT_SEC = 30.0
+AIRTABLE_MAX_REQ_PER_SEC = 5.0  # Airtable's per-base limit
+AIRTABLE_PUSH_WORKERS = 5  # batches in flight at once (the per-base rate limit still applies)
+# Batches built and queued ahead of the results being read, so a big push never holds every payload
+AIRTABLE_PUSH_MAX_QUEUED = AIRTABLE_PUSH_WORKERS * 2
+
+
+class _TokenBucket:
+    """Thread-safe token bucket: acquire() blocks only once the budget is spent, so time a request
+    already took counts towards the spacing (unlike a fixed sleep after each one)."""
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self._rate = rate
+        self._burst = burst
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._last) * self._rate)
+            self._last = now
+            wait = (1 - self._tokens) / self._rate if self._tokens < 1 else 0.0
+            # Claim the token now (possibly going negative) so waiting threads queue up behind us
+            self._tokens -= 1
+        if wait > 0:
+            time.sleep(wait)
+
+
+# Airtable's limit is per base, so each base gets its own bucket (shared by concurrent pushes to it).
+# No burst: 5 back-to-back requests plus the steady rate would exceed 5 req/sec in the first second.
+_airtable_buckets: dict[str, _TokenBucket] = {}
+_airtable_buckets_lock = threading.Lock()
+
+
+def _airtable_bucket(base_id: str) -> _TokenBucket:
+    with _airtable_buckets_lock:
+        bucket = _airtable_buckets.get(base_id)
+        if bucket is None:
+            rate = min(AIRTABLE_MAX_REQ_PER_SEC, 1 / _airtable_rate_delay())
+            bucket = _airtable_buckets[base_id] = _TokenBucket(rate)
+        return bucket
 
 
 def _airtable_rate_delay() -> float:
-    """Delay between Airtable batch requests. Airtable allows 5 req/sec; 0.18 is slightly faster, 0.2 is safe."""
+    """Minimum spacing between Airtable batch request starts (per base). Values below 0.2 are capped at
+    Airtable's 5 req/sec by the bucket, since concurrent workers keep that pace sustained."""
     raw = env("EXPORT_AIRTABLE_DELAY", "")
     if raw:
         try:
             return max(0.15, float(raw))
         except ValueError:
             pass
-    return 0.18
+    return 0.2
+
+
+_TABLE_NAME_TRANS = str.maketrans({"/": " ", "\\": " ", "?": " ", "#": " "})
 
 
 def _sanitize_table_name(name: str) -> str:
     """Make a string safe for Airtable table name (strip, replace invalid chars, limit length)."""
-    s = (name or "").strip()
-    for c in ["/", "\\", "?", "#"]:
-        s = s.replace(c, " ")
+    s = (name or "").strip().translate(_TABLE_NAME_TRANS)
     s = " ".join(s.split())[:100]
     return s or "Untitled"
 
 
+def _airtable_headers(api_key: str) -> dict[str, str]:
+    """Headers for Airtable JSON requests; built once per push and reused for every batch."""
+    return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+
 def create_airtable_table(
     api_key: str, base_id: str, table_name: str, field_ids: list[str] | None = None
 ) -> str:
@@ -1068,18 +1499,10 @@ def create_airtable_table(
     if not name:
         name = "Exported items"
     # Avoid 422 "duplicate name" by making name unique (Airtable bases can't have two tables with same name)
-    from datetime import datetime
-    unique_name = f"{name} ({datetime.now().strftime('%Y-%m-%d %H.%M')})"
-    schema = _build_table_schema(field_ids)
+    unique_name = f"{name} ({time.strftime('%Y-%m-%d %H.%M')})"
+    schema = _build_table_schema(tuple(field_ids) if field_ids else None)
     payload = {"name": unique_name, "description": "Exported from Lightspeed", "fields": schema}
-    resp = requests.post(
-        url,
-        json=payload,
-        headers={
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        },
-    )
+    resp = HTTP_SESSION.post(url, json=payload, headers=_airtable_headers(api_key))
     if not resp.ok:
         body = (resp.text or "")[:600]
         try:
@@ -1104,60 +1527,177 @@ def push_to_airtable(
     base_id: str,
     table_name: str,
     field_ids: list[str] | None = None,
+    upsert_field: str | None = None,
 ) -> None:
-    """Create Airtable records in batches. Uses Images as Attachment field so photos display."""
+    """Create Airtable records in batches. Uses Images as Attachment field so photos display.
+    With upsert_field (an Airtable field name, e.g. "Item ID"), records are upserted on that field via
+    PATCH instead, so re-running an export into the same table updates rows rather than duplicating them.
+    """
     if not rows:
         print("No rows to push to Airtable.", file=sys.stderr)
         return
-    ids = field_ids or _field_ids_from_env()
+    # A tuple, so the per-row field-spec lookup is a straight cache hit
+    ids = tuple(field_ids or _field_ids_from_env())
+    bucket = _airtable_bucket(base_id)
+    url = f"{AIRTABLE_API_BASE}/{base_id}/{quote(table_name, safe='')}"
+    headers = _airtable_headers(api_key)
+
+    send = HTTP_SESSION.patch if upsert_field else HTTP_SESSION.post
+    upsert = {"performUpsert": {"fieldsToMergeOn": [upsert_field]}} if upsert_field else {}
+
+    def post_batch(records: list[dict]) -> tuple[requests.Response, float]:
+        """Send one batch once the bucket allows; returns (response, seconds spent waiting out a 429)."""
+        # Serialized once (reused if a 429 forces a resend); orjson when installed
+        payload = {"records": records, **upsert}
+        body = orjson.dumps(payload) if orjson is not None else json.dumps(payload).encode()
+        bucket.acquire()
+        resp = send(url, data=body, headers=headers)
+        if resp.status_code != 429:
+            return resp, 0.0
+        try:
+            wait = max(1.0, float(resp.headers.get("Retry-After") or ""))
+        except ValueError:
+            wait = AIRTABLE_429_WAIT_SEC
+        time.sleep(wait)
+        bucket.acquire()
+        return send(url, data=body, headers=headers), wait
+
+    # Several batches are in flight at once so round-trips overlap; the bucket still caps the rate.
+    # Results are handled here, in order, so logging stays on the caller's thread. Only
+    # AIRTABLE_PUSH_MAX_QUEUED batches are built ahead, and a failed batch stops further submission.
     total = 0
-    for i in range(0, len(rows), AIRTABLE_BATCH_SIZE):
-        batch = rows[i : i + AIRTABLE_BATCH_SIZE]
-        records = [{"fields": row_to_airtable_fields(r, ids)} for r in batch]
-        url = f"{AIRTABLE_API_BASE}/{base_id}/{quote(table_name, safe='')}"
-        resp = requests.post(
-            url,
-            json={"records": records},
-            headers={
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json",
-            },
-        )
-        if resp.status_code == 429:
-            print("  Airtable rate limit; waiting 30s...", file=sys.stderr)
-            time.sleep(30)
-            resp = requests.post(
-                url,
-                json={"records": records},
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json",
-                },
-            )
-        if not resp.ok:
-            body = (resp.text or "")[:400]
-            try:
-                err = resp.json()
-                msg = err.get("error", {}).get("message") if isinstance(err.get("error"), dict) else str(err)
-                print(f"  Airtable error ({resp.status_code}): {msg}", file=sys.stderr)
-            except Exception:
-                print(f"  Airtable error ({resp.status_code}): {body}", file=sys.stderr)
-            if resp.status_code == 403:
-                print(f"  403 response body: {body}", file=sys.stderr)
-                print(
-                    "  Fix: airtable.com/create/tokens -> add data.records:read + data.records:write, "
-                    "add this base (or its workspace). Copy the token again after saving and set AIRTABLE_API_KEY in .env, then restart the backend.",
-                    file=sys.stderr,
-                )
-        resp.raise_for_status()
-        total += len(batch)
-        if total % 500 == 0 or total == len(rows):
-            print(f"  Pushed {total}/{len(rows)} records to Airtable.", file=sys.stderr)
-        time.sleep(_airtable_rate_delay())
+    queued: deque[tuple[int, concurrent.futures.Future]] = deque()
+    executor = _ContextThreadPoolExecutor(max_workers=AIRTABLE_PUSH_WORKERS)
+    try:
+        row_iter = iter(rows)
+        while True:
+            batch = itertools.islice(row_iter, AIRTABLE_BATCH_SIZE)
+            records = [{"fields": row_to_airtable_fields(r, ids)} for r in batch]
+            if records:
+                queued.append((len(records), executor.submit(post_batch, records)))
+            # Drain down to the window while rows remain, then everything once they run out
+            while queued and (len(queued) >= AIRTABLE_PUSH_MAX_QUEUED or not records):
+                batch_len, fut = queued.popleft()
+                resp, rate_limit_wait = fut.result()
+                if rate_limit_wait:
+                    print(f"  Airtable rate limit; waited {rate_limit_wait:.0f}s and retried.", file=sys.stderr)
+                if not resp.ok:
+                    # Only the head of the body is decoded; proxy error pages (HTML 502s) skip the JSON parse
+                    body = resp.content[:400].decode("utf-8", errors="replace")
+                    msg = body
+                    if "json" in (resp.headers.get("Content-Type") or ""):
+                        try:
+                            err = _response_json(resp)
+                        except ValueError:
+                            err = None
+                        if isinstance(err, dict):
+                            msg = err["error"].get("message") if isinstance(err.get("error"), dict) else str(err)
+                    print(f"  Airtable error ({resp.status_code}): {msg}", file=sys.stderr)
+                    if resp.status_code == 403:
+                        print(f"  403 response body: {body}", file=sys.stderr)
+                        print(
+                            "  Fix: airtable.com/create/tokens -> add data.records:read + data.records:write, "
+                            "add this base (or its workspace). Copy the token again after saving and set AIRTABLE_API_KEY in .env, then restart the backend.",
+                            file=sys.stderr,
+                        )
+                resp.raise_for_status()
+                total += batch_len
+                if total % 500 == 0 or total == len(rows):
+                    print(f"  Pushed {total}/{len(rows)} records to Airtable.", file=sys.stderr)
+            if not records:
+                break
+    finally:
+        # On a failed batch, don't send the ones still queued
+        executor.shutdown(wait=True, cancel_futures=True)
     print(f"Pushed {total} records to Airtable.", file=sys.stderr)
 
 
+def _push_export(
+    session: requests.Session | SessionWithRefresh,
+    account_id: str,
+    category_id: str | None,
+    rows: list[dict],
+    api_key: str,
+    base_id: str,
+    field_ids: list[str],
+    create_new: bool,
+    table_name: str = "Items",
+    upsert_field: str | None = None,
+) -> str:
+    """Push rows to Airtable, first creating a table named after the category when create_new.
+    Returns the table pushed to (a tblxxx id for a new table). upsert_field is passed to push_to_airtable."""
+    if create_new:
+        if category_id:
+            display_name = get_category_name(session, account_id, category_id)
+        else:
+            display_name = "All categories"
+        display_name = _sanitize_table_name(display_name)
+        print(f"Creating new Airtable table: {display_name}", file=sys.stderr)
+        table_name = create_airtable_table(api_key, base_id, display_name, field_ids)  # returns table id (tblxxx)
+    print("Pushing to Airtable (images as photos)...", file=sys.stderr)
+    push_to_airtable(rows, api_key, base_id, table_name, field_ids, upsert_field=upsert_field)
+    return table_name
+
+
+def run_export(
+    *,
+    access_token: str,
+    refresh_token: str,
+    client_id: str,
+    client_secret: str,
+    account_id: str,
+    airtable_key: str,
+    base_id: str,
+    field_ids: list[str],
+    category_id: str | None = None,
+    listing_filters: dict | None = None,
+    create_new_table: bool = True,
+    table_name: str = "Items",
+    token_refresher: Callable[[str], tuple[str, str, float | None]] | None = None,
+) -> dict:
+    """Export items and push them to Airtable in-process (the export backend calls this per job).
+
+    Unlike main() this writes no output files and reads no env settings. Returns {"table_id",
+    "records", "access_token", "refresh_token", "expires_in"}; the tokens differ from the ones passed
+    in when a 401 made the session refresh, and the caller should store them along with expires_in
+    (seconds left on the new access token, None if unknown). With token_refresher the session
+    refreshes through it (see SessionWithRefresh), which is then responsible for storing the tokens.
+    Raises LightspeedAuthError when the refresh token is rejected.
+    """
+    session = SessionWithRefresh(access_token, refresh_token, client_id, client_secret, token_refresher)
+    rows = export_items(
+        session,
+        account_id,
+        load_relations=[],
+        include_images=("image" in field_ids),
+        category_id=category_id,
+        field_ids=field_ids,
+        listing_filters=listing_filters or {},
+        selected_columns_only=True,
+    )
+    table_id = _push_export(
+        session, account_id, category_id, rows, airtable_key, base_id, field_ids, create_new_table, table_name
+    )
+    print(f"Done. Total records: {len(rows)}", file=sys.stderr)
+    access_token, refresh_token = session.tokens
+    return {
+        "table_id": table_id if table_id.startswith("tbl") else None,
+        "records": len(rows),
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expires_in": session.expires_in,
+    }
+
+
 def main() -> None:
+    try:
+        _run_cli()
+    except LightspeedAuthError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
+
+
+def _run_cli() -> None:
     load_dotenv()
     parser = argparse.ArgumentParser(
         description="Export Lightspeed R-Series items to Airtable-ready JSON/CSV."
@@ -1234,7 +1774,15 @@ def main() -> None:
         action="store_true",
         help="List all item categories (ID and name) and exit. Use this to find --category-id.",
     )
+    parser.add_argument(
+        "--refresh-cache",
+        action="store_true",
+        help="Refetch vendors, categories, brands and departments instead of using the on-disk lookup cache.",
+    )
     args = parser.parse_args()
+    global use_lookup_cache, refresh_lookup_cache
+    use_lookup_cache = True
+    refresh_lookup_cache = args.refresh_cache
 
     if not args.account_id and not args.login:
         print(
@@ -1367,25 +1915,22 @@ def main() -> None:
         base_id = env("AIRTABLE_BASE_ID")
         create_new = (env("AIRTABLE_CREATE_NEW_TABLE") or "").strip().lower() in ("1", "true", "yes")
         if api_key and base_id:
-            field_ids = _field_ids_from_env()
-            if create_new:
-                if category_id:
-                    display_name = get_category_name(session, args.account_id, category_id)
-                else:
-                    display_name = "All categories"
-                display_name = _sanitize_table_name(display_name)
-                print(f"Creating new Airtable table: {display_name}", file=sys.stderr)
-                table_name = create_airtable_table(api_key, base_id, display_name, field_ids)  # returns table id (tblxxx)
-                print(f"AIRTABLE_TABLE_ID={table_name}", file=sys.stderr)  # for backend to open that table
-            else:
-                table_name = env("AIRTABLE_TABLE_NAME") or "Items"
-            print("Pushing to Airtable (images as photos)...", file=sys.stderr)
-            push_to_airtable(rows, api_key, base_id, table_name, field_ids)
-            # When run by the export backend, the extension opens the tab; don't open a second one
-            if not env("FROM_EXPORT_BACKEND"):
-                url = f"https://airtable.com/{base_id}/{table_name}" if table_name.startswith("tbl") else f"https://airtable.com/{base_id}"
-                webbrowser.open(url)
-                print("Opened Airtable base in browser.", file=sys.stderr)
+            table_name = _push_export(
+                session,
+                args.account_id,
+                category_id,
+                rows,
+                api_key,
+                base_id,
+                field_ids,
+                create_new,
+                env("AIRTABLE_TABLE_NAME") or "Items",
+                # A fresh table has nothing to merge with
+                upsert_field=None if create_new else (env("AIRTABLE_UPSERT_FIELD") or None),
+            )
+            url = f"https://airtable.com/{base_id}/{table_name}" if table_name.startswith("tbl") else f"https://airtable.com/{base_id}"
+            webbrowser.open(url)
+            print("Opened Airtable base in browser.", file=sys.stderr)
 
     print(f"Done. Total records: {len(rows)}", file=sys.stderr)
 